@@ -0,0 +1,39 @@
+﻿from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+from app.db.session import get_db
+from app.db.models import User
+from app.api.auth import get_current_admin_user
+from app.services.calculation_writer import calculation_writer
+from app.services.reconciliation_service import reconcile
+from app.core.profiling import list_profiles, profile_file_path
+
+router = APIRouter()
+
+@router.get("/reconciliation")
+def reconcile_all_users(
+    flagged_only: bool = True,
+    current_user: User = Depends(get_current_admin_user),
+    db: Session = Depends(get_db)
+):
+    calculation_writer.flush()
+    pairs = reconcile(db)
+    
+    return {
+        "pairs_checked": len(pairs),
+        "flagged": sum(1 for pair in pairs if pair["flagged"]),
+        "results": [pair for pair in pairs if pair["flagged"]] if flagged_only else pairs
+    }
+
+@router.get("/profiles")
+def get_profiles(limit: int = 20, current_user: User = Depends(get_current_admin_user)):
+    return list_profiles()[:limit]
+
+@router.get("/profiles/{profile_id}")
+def download_profile(profile_id: str, current_user: User = Depends(get_current_admin_user)):
+    file_path = profile_file_path(profile_id)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    
+    # Folded stacks: feed to flamegraph.pl or drop into speedscope
+    return FileResponse(file_path, media_type="text/plain", filename=f"{profile_id}.folded")
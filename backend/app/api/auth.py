@@ -6,6 +6,7 @@ from datetime import datetime
 from app.db.session import get_db
 from app.db.models import User
 from app.core.security import hash_password, verify_password, create_access_token, decode_access_token
+from app.core.metrics import stage_timer
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
@@ -76,12 +77,20 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     return user
 
 def get_current_active_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    payload = decode_access_token(token)
+    with stage_timer("jwt_decode"):
+        payload = decode_access_token(token)
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    user = db.query(User).filter(User.email == payload.get("sub")).first()
+    with stage_timer("user_lookup"):
+        user = db.query(User).filter(User.email == payload.get("sub")).first()
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
     
     return user
+
+def get_current_admin_user(current_user: User = Depends(get_current_active_user)):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return current_user
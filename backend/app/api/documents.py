@@ -1,15 +1,24 @@
-﻿from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status
+﻿from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Response, UploadFile, File, Query, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import List
-import shutil
+from typing import Dict, List
+import anyio
 import os
+import time
 from datetime import datetime
 from app.db.session import get_db
-from app.db.models import User, Document, ExtractedData
+from app.db.models import User, Document, DocumentBatch, ExtractedData
 from app.api.auth import get_current_active_user
-from app.services.ocr_service import extract_text_from_pdf
+from app.services.ocr_service import sniff_file_type
+from app.services.document_store import load_document_text, load_document_page
+from app.services.search_service import remove_document, search_documents
+from app.services.ingestion_service import (
+    ZIP_SIGNATURE, stored_upload_path, process_document, submit_documents, unpack_zip, batch_progress
+)
+from app.services.rag_service import user_documents
 from app.core.config import settings
+from app.core.metrics import stage_latency
 
 router = APIRouter()
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
@@ -25,6 +34,44 @@ class DocumentResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class DocumentTextResponse(BaseModel):
+    document_id: int
+    page: int | None
+    page_count: int
+    text: str
+
+class SearchHit(BaseModel):
+    document_id: int
+    original_filename: str | None
+    snippet: str
+    rank: float
+
+class DocumentSearchResponse(BaseModel):
+    query: str
+    page: int
+    page_size: int
+    total: int
+    results: List[SearchHit]
+
+class RejectedFile(BaseModel):
+    filename: str
+    reason: str
+
+class BatchUploadResponse(BaseModel):
+    batch_id: int
+    accepted: List[DocumentResponse]
+    rejected: List[RejectedFile]
+
+class BatchProgressResponse(BaseModel):
+    batch_id: int
+    total: int
+    completed: int
+    failed: int
+    pending: int
+    finished: bool
+    status_counts: Dict[str, int]
+    documents: List[DocumentResponse]
+
 class ExtractedDataResponse(BaseModel):
     field_name: str
     field_value: str
@@ -33,31 +80,60 @@ class ExtractedDataResponse(BaseModel):
     class Config:
         from_attributes = True
 
+async def save_upload(file: UploadFile, file_path: str):
+    # Copy in chunks with async file I/O, sniffing the type from the first
+    # chunk and giving up as soon as the size limit is crossed
+    size = 0
+    file_type = None
+    started = time.perf_counter()
+    try:
+        async with await anyio.open_file(file_path, "wb") as buffer:
+            while True:
+                chunk = await file.read(settings.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if file_type is None:
+                    file_type = sniff_file_type(chunk)
+                    if file_type is None:
+                        raise HTTPException(status_code=400, detail="Only PDF and image files allowed")
+                size += len(chunk)
+                if size > settings.MAX_FILE_SIZE:
+                    raise HTTPException(status_code=413, detail=f"File exceeds {settings.MAX_FILE_SIZE} bytes")
+                await buffer.write(chunk)
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    
+    if file_type is None:
+        os.remove(file_path)
+        raise HTTPException(status_code=400, detail="Uploaded file is empty")
+    
+    elapsed = max(time.perf_counter() - started, 1e-6)
+    stage_latency.observe(elapsed, stage="upload_write")
+    return size, file_type, size / elapsed
+
 @router.post("/upload", response_model=DocumentResponse, status_code=status.HTTP_201_CREATED)
 async def upload_document(
+    background_tasks: BackgroundTasks,
+    response: Response,
     file: UploadFile = File(...),
     document_type: str = "bank_statement",
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    if not file.filename.endswith(('.pdf', '.png', '.jpg', '.jpeg')):
-        raise HTTPException(status_code=400, detail="Only PDF and image files allowed")
-    
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{current_user.id}_{timestamp}_{file.filename}"
-    file_path = os.path.join(settings.UPLOAD_DIR, filename)
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    original_filename = os.path.basename(file.filename or "upload")
+    file_path = stored_upload_path(current_user.id, original_filename)
     
-    file_size = os.path.getsize(file_path) // 1024
+    size, file_type, bytes_per_sec = await save_upload(file, file_path)
+    response.headers["X-Upload-Bytes-Per-Second"] = str(int(bytes_per_sec))
     
     document = Document(
         user_id=current_user.id,
         document_type=document_type,
         file_path=file_path,
-        original_filename=file.filename,
-        file_size_kb=file_size,
+        original_filename=original_filename,
+        file_size_kb=size // 1024,
         processing_status="uploaded"
     )
     
@@ -66,26 +142,14 @@ async def upload_document(
     db.refresh(document)
     
     try:
-        document.processing_status = "processing"
-        db.commit()
-        
-        extracted_text = extract_text_from_pdf(file_path)
-        
-        extracted_field = ExtractedData(
-            document_id=document.id,
-            field_name="raw_text",
-            field_value=extracted_text[:5000],
-            confidence_score=0.85,
-            is_validated=False
-        )
+        # PDF parsing and OCR are CPU-bound: keep them off the event loop
+        extracted_text = await run_in_threadpool(process_document, db, document, current_user.id)
         
-        db.add(extracted_field)
-        document.processing_status = "completed"
-        document.ocr_confidence = 0.85
-        db.commit()
-        db.refresh(document)
+        # Chunk + embed for chat retrieval after the response has been sent
+        background_tasks.add_task(user_documents.add_document, current_user.id, document.id, extracted_text)
         
     except Exception as e:
+        db.rollback()
         document.processing_status = "error"
         document.error_message = str(e)
         db.commit()
@@ -93,11 +157,136 @@ async def upload_document(
     
     return document
 
+@router.post("/batch", response_model=BatchUploadResponse, status_code=status.HTTP_202_ACCEPTED)
+async def upload_document_batch(
+    files: List[UploadFile] = File(...),
+    document_type: str = "bank_statement",
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    accepted, rejected = [], []
+    budget = settings.BATCH_MAX_EXTRACTED_SIZE
+    
+    for file in files:
+        original_filename = os.path.basename(file.filename or "upload")
+        head = await file.read(len(ZIP_SIGNATURE))
+        await file.seek(0)
+        
+        if len(accepted) >= settings.BATCH_MAX_FILES or budget <= 0:
+            rejected.append({"filename": original_filename, "reason": "Batch limit reached"})
+            continue
+        
+        if head == ZIP_SIGNATURE:
+            unpacked, skipped, budget = await run_in_threadpool(
+                unpack_zip, file.file, current_user.id, budget, settings.BATCH_MAX_FILES - len(accepted)
+            )
+            accepted.extend(unpacked)
+            rejected.extend(skipped)
+            continue
+        
+        file_path = stored_upload_path(current_user.id, original_filename)
+        try:
+            size, file_type, _ = await save_upload(file, file_path)
+        except HTTPException as e:
+            rejected.append({"filename": original_filename, "reason": e.detail})
+            continue
+        budget -= size
+        accepted.append({"filename": original_filename, "file_path": file_path, "size": size, "file_type": file_type})
+    
+    if not accepted:
+        raise HTTPException(status_code=400, detail={"message": "No valid documents in batch", "rejected": rejected})
+    
+    # All rows in one transaction; extraction fans out to the ingestion pool afterwards
+    batch = DocumentBatch(user_id=current_user.id, document_type=document_type, total_documents=len(accepted))
+    documents = [
+        Document(
+            user_id=current_user.id,
+            document_type=document_type,
+            file_path=item["file_path"],
+            original_filename=item["filename"],
+            file_size_kb=item["size"] // 1024,
+            processing_status="uploaded",
+            batch=batch
+        )
+        for item in accepted
+    ]
+    db.add(batch)
+    db.add_all(documents)
+    db.flush()
+    # Serialized before commit: afterwards every Document is expired and
+    # reading it back would cost one SELECT per file
+    response = {
+        "batch_id": batch.id,
+        "accepted": [DocumentResponse.model_validate(document) for document in documents],
+        "rejected": rejected
+    }
+    document_ids = [document.id for document in documents]
+    db.commit()
+    
+    submit_documents(document_ids)
+    
+    return response
+
+@router.get("/batch/{batch_id}", response_model=BatchProgressResponse)
+def get_batch_progress(
+    batch_id: int,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    batch = db.query(DocumentBatch).filter(
+        DocumentBatch.id == batch_id,
+        DocumentBatch.user_id == current_user.id
+    ).first()
+    
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    
+    status_counts = batch_progress(db, batch_id)
+    completed = status_counts.get("completed", 0)
+    failed = status_counts.get("error", 0)
+    total = sum(status_counts.values())
+    documents = db.query(Document).filter(Document.batch_id == batch_id).order_by(Document.id).all()
+    
+    return {
+        "batch_id": batch_id,
+        "total": total,
+        "completed": completed,
+        "failed": failed,
+        "pending": total - completed - failed,
+        "finished": completed + failed == total,
+        "status_counts": status_counts,
+        "documents": documents
+    }
+
 @router.get("/", response_model=List[DocumentResponse])
 def list_documents(current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
     documents = db.query(Document).filter(Document.user_id == current_user.id).all()
     return documents
 
+@router.get("/search", response_model=DocumentSearchResponse)
+def search_user_documents(
+    q: str = Query(..., min_length=2, max_length=200),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(10, ge=1, le=50),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    total, results = search_documents(
+        db,
+        user_id=current_user.id,
+        query=q,
+        limit=page_size,
+        offset=(page - 1) * page_size
+    )
+    
+    return {
+        "query": q,
+        "page": page,
+        "page_size": page_size,
+        "total": total,
+        "results": results
+    }
+
 @router.get("/{document_id}/data", response_model=List[ExtractedDataResponse])
 def get_extracted_data(
     document_id: int,
@@ -115,9 +304,40 @@ def get_extracted_data(
     extracted_data = db.query(ExtractedData).filter(ExtractedData.document_id == document_id).all()
     return extracted_data
 
+@router.get("/{document_id}/text", response_model=DocumentTextResponse)
+def get_document_text(
+    document_id: int,
+    page: int | None = Query(None, ge=1),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    document = db.query(Document).filter(
+        Document.id == document_id,
+        Document.user_id == current_user.id
+    ).first()
+    
+    if not document or not document.text_blob:
+        raise HTTPException(status_code=404, detail="Document text not found")
+    
+    if page is None:
+        text = load_document_text(db, document_id)
+    else:
+        # Pages are 1-based like /search; the store indexes from 0
+        text = load_document_page(db, document_id, page - 1)
+        if text is None:
+            raise HTTPException(status_code=404, detail="Page not found")
+    
+    return {
+        "document_id": document_id,
+        "page": page,
+        "page_count": document.text_blob.page_count,
+        "text": text
+    }
+
 @router.delete("/{document_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_document(
     document_id: int,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
@@ -132,7 +352,10 @@ def delete_document(
     if os.path.exists(document.file_path):
         os.remove(document.file_path)
     
+    remove_document(db, document_id)
     db.delete(document)
     db.commit()
     
+    background_tasks.add_task(user_documents.remove_document, current_user.id, document_id)
+    
     return None
@@ -1,12 +1,28 @@
-﻿from fastapi import APIRouter, Depends, HTTPException, status
+﻿from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, UploadFile, File, status
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from sqlalchemy import func
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from typing import List, Dict
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Dict, Optional
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from datetime import datetime
 from app.db.session import get_db
 from app.db.models import User, TaxCalculation, TaxReturnForm
 from app.api.auth import get_current_active_user
-from app.services.tax_engine import calculate_income_tax, apply_deductions
+from app.services.tax_engine import calculate_income_tax, apply_deductions, sweep_scenarios, optimize_deductions
 from app.services.ai_service import ask_tax_question
+from app.services.payroll_service import stream_withholding_csv, validate_payroll_upload
+from app.services.calculation_writer import calculation_writer, tax_input_hash
+from app.services.form_service import (
+    collect_form_data, content_hash, form_file_path, render_tax_form, parse_range, iter_file_range
+)
+from app.core.config import settings
 
 router = APIRouter()
 
@@ -22,7 +38,27 @@ class TaxResult(BaseModel):
     taxable_income: float
     tax_liability: float
     breakdown: List[Dict]
+
+class DeductionMix(BaseModel):
+    life_insurance: float = Field(0, ge=0)
+    charity: float = Field(0, ge=0)
+    pension: float = Field(0, ge=0)
+
+class ScenarioInput(BaseModel):
+    income_min: float = Field(0, ge=0)
+    income_max: float = Field(..., gt=0)
+    income_steps: int = Field(200, ge=2, le=5000)
+    mixes: List[DeductionMix] = Field(default_factory=lambda: [DeductionMix()], max_length=100)
+    deduction_budget: Optional[float] = Field(None, ge=0)
     
+    @model_validator(mode="after")
+    def check_range(self):
+        if self.income_max <= self.income_min:
+            raise ValueError("income_max must be greater than income_min")
+        if self.income_steps * len(self.mixes) > settings.SCENARIO_MAX_POINTS:
+            raise ValueError(f"income_steps x mixes must not exceed {settings.SCENARIO_MAX_POINTS} points")
+        return self
+
 class ChatMessage(BaseModel):
     question: str
 
@@ -34,46 +70,132 @@ class ChatResponse(BaseModel):
 def calculate_tax(
     tax_input: TaxInput,
     tax_year: int = 2026,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user)
 ):
+    # Front-ends recalculate on every keystroke: identical inputs are answered
+    # from the memo and stored once, and history is written behind the request
+    input_hash = tax_input_hash(tax_input.model_dump())
+    key = (current_user.id, tax_year, input_hash)
+    cached = calculation_writer.lookup(key)
+    if cached is not None:
+        return cached
+    
     total_income = tax_input.salary_income + tax_input.business_income + tax_input.other_income
     total_deductions = apply_deductions(tax_input.deductions)
     taxable_income = max(0, total_income - total_deductions)
     tax_liability, breakdown = calculate_income_tax(taxable_income)
     
-    calculation = TaxCalculation(
-        user_id=current_user.id,
-        tax_year=tax_year,
-        total_income=total_income,
-        salary_income=tax_input.salary_income,
-        business_income=tax_input.business_income,
-        other_income=tax_input.other_income,
-        total_deductions=total_deductions,
-        taxable_income=taxable_income,
-        tax_liability=tax_liability,
-        status="completed"
-    )
-    
-    db.add(calculation)
-    db.commit()
-    db.refresh(calculation)
-    
-    return {
+    result = {
         "total_income": total_income,
         "total_deductions": total_deductions,
         "taxable_income": taxable_income,
         "tax_liability": tax_liability,
         "breakdown": breakdown
     }
+    
+    calculation_writer.submit(key, result, {
+        "user_id": current_user.id,
+        "tax_year": tax_year,
+        "total_income": total_income,
+        "salary_income": tax_input.salary_income,
+        "business_income": tax_input.business_income,
+        "other_income": tax_input.other_income,
+        "total_deductions": total_deductions,
+        "taxable_income": taxable_income,
+        "tax_liability": tax_liability,
+        "calculation_date": datetime.utcnow(),
+        "status": "completed",
+        "input_hash": input_hash
+    })
+    
+    return result
+
+@router.post("/payroll/withholding")
+async def calculate_payroll_withholding(
+    file: UploadFile = File(...),
+    tax_year: int = 2026,
+    months_remaining: int = 12,
+    current_user: User = Depends(get_current_active_user)
+):
+    if not 1 <= months_remaining <= 12:
+        raise HTTPException(status_code=400, detail="months_remaining must be between 1 and 12")
+    
+    filename = (file.filename or "").lower()
+    if filename.endswith((".ndjson", ".jsonl")) or file.content_type == "application/x-ndjson":
+        fmt = "ndjson"
+    elif filename.endswith(".csv") or file.content_type == "text/csv":
+        fmt = "csv"
+    else:
+        raise HTTPException(status_code=400, detail="Upload a CSV or NDJSON file")
+    
+    # FastAPI closes the UploadFile once this handler returns, so hand the
+    # streaming response its own disk-backed copy
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    await run_in_threadpool(shutil.copyfileobj, file.file, spool)
+    spool.seek(0)
+    try:
+        await run_in_threadpool(validate_payroll_upload, spool, fmt)
+    except ValueError as e:
+        spool.close()
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return StreamingResponse(
+        stream_withholding_csv(
+            spool,
+            fmt,
+            user_id=current_user.id,
+            tax_year=tax_year,
+            months_remaining=months_remaining,
+            chunk_size=settings.PAYROLL_CHUNK_SIZE
+        ),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename=withholding_{tax_year}.csv"}
+    )
+
+@router.post("/scenarios")
+def tax_scenarios(
+    scenario: ScenarioInput,
+    current_user: User = Depends(get_current_active_user)
+):
+    start = time.perf_counter()
+    incomes = np.linspace(scenario.income_min, scenario.income_max, scenario.income_steps)
+    mixes = np.array([[mix.life_insurance, mix.charity, mix.pension] for mix in scenario.mixes])
+    
+    sweep = sweep_scenarios(incomes, mixes)
+    result = {
+        "incomes": incomes.round(2).tolist(),
+        "mixes": [mix.model_dump() for mix in scenario.mixes],
+        "tax": sweep["tax"].tolist(),
+        "effective_rate": sweep["effective_rate"].round(6).tolist(),
+        "marginal_rate": sweep["marginal_rate"].tolist(),
+        "allowed_deductions": sweep["allowed_deductions"].round(2).tolist()
+    }
+    
+    if scenario.deduction_budget is not None:
+        optimal = optimize_deductions(incomes, scenario.deduction_budget)
+        result["optimal_allocation"] = {
+            "budget": scenario.deduction_budget,
+            **{name: values.round(2).tolist() for name, values in optimal.items()}
+        }
+    
+    result["points"] = int(incomes.size * mixes.shape[0])
+    # Encoded here instead of through jsonable_encoder, which walks every float
+    # and dominated large grids; the timing header is taken after encoding
+    body = json.dumps(result, separators=(",", ":"))
+    elapsed_ms = round((time.perf_counter() - start) * 1000, 3)
+    return Response(body, media_type="application/json", headers={"X-Elapsed-Ms": str(elapsed_ms)})
 
 @router.get("/history")
 def get_tax_history(
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
+    # Read-your-writes: push any buffered calculations out before listing
+    calculation_writer.flush()
+    # Payroll rows belong to the employer's employees, not to this user
     calculations = db.query(TaxCalculation).filter(
-        TaxCalculation.user_id == current_user.id
+        TaxCalculation.user_id == current_user.id,
+        TaxCalculation.status != "payroll"
     ).order_by(TaxCalculation.calculation_date.desc()).all()
     
     return calculations
@@ -84,7 +206,7 @@ async def chat_with_ai(
     current_user: User = Depends(get_current_active_user)
 ):
     try:
-        answer = await ask_tax_question(message.question)
+        answer = await ask_tax_question(message.question, user_id=current_user.id)
         return {
             "answer": answer,
             "sources": ["FBR Tax Rules 2025-26", "AI Analysis"]
@@ -101,31 +223,98 @@ def get_tax_slabs():
         "note": "Tax rates as per Federal Board of Revenue (FBR)"
     }
 
-@router.post("/generate-form/{calculation_id}")
+@router.post("/generate-form/{calculation_id}", status_code=status.HTTP_202_ACCEPTED)
 def generate_tax_form(
     calculation_id: int,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     calculation = db.query(TaxCalculation).filter(
         TaxCalculation.id == calculation_id,
-        TaxCalculation.user_id == current_user.id
+        TaxCalculation.user_id == current_user.id,
+        TaxCalculation.status != "payroll"
     ).first()
     
     if not calculation:
         raise HTTPException(status_code=404, detail="Calculation not found")
     
-    form = TaxReturnForm(
-        calculation_id=calculation_id,
-        pdf_file_path=f"forms/tax_return_{calculation_id}.pdf"
-    )
+    form_hash = content_hash(collect_form_data(db, calculation))
+    path = form_file_path(form_hash)
+    
+    form = calculation.tax_form
+    if not form:
+        form = TaxReturnForm(calculation_id=calculation_id)
+        db.add(form)
+        db.flush()
+    
+    # Rendered PDFs are cached by content hash: unchanged data never re-renders
+    if os.path.exists(path):
+        form.content_hash = form_hash
+        form.pdf_file_path = path
+        form.status = "ready"
+    else:
+        form.status = "pending"
+        background_tasks.add_task(render_tax_form, form.id)
     
-    db.add(form)
     db.commit()
     db.refresh(form)
     
     return {
-        "message": "Tax form generated successfully",
+        "message": "Tax form ready" if form.status == "ready" else "Tax form is being generated",
         "form_id": form.id,
+        "status": form.status,
         "download_url": f"/api/tax/download-form/{form.id}"
     }
+
+@router.get("/download-form/{form_id}")
+def download_tax_form(
+    form_id: int,
+    range_header: str | None = Header(None, alias="Range"),
+    if_none_match: str | None = Header(None, alias="If-None-Match"),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    form = db.query(TaxReturnForm).join(TaxCalculation).filter(
+        TaxReturnForm.id == form_id,
+        TaxCalculation.user_id == current_user.id
+    ).first()
+    
+    if not form:
+        raise HTTPException(status_code=404, detail="Tax form not found")
+    
+    if form.status != "ready" or not form.pdf_file_path or not os.path.exists(form.pdf_file_path):
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={"form_id": form.id, "status": form.status})
+    
+    etag = f'"{form.content_hash}"'
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "private, max-age=0, must-revalidate"}
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    size = os.path.getsize(form.pdf_file_path)
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                        headers={**headers, "Content-Range": f"bytes */{size}"})
+    
+    start, end = byte_range or (0, size - 1)
+    if start == 0:
+        # Count downloads in SQL so concurrent requests can't lose increments
+        db.query(TaxReturnForm).filter(TaxReturnForm.id == form.id).update(
+            {TaxReturnForm.download_count: func.coalesce(TaxReturnForm.download_count, 0) + 1},
+            synchronize_session=False
+        )
+        db.commit()
+    
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Disposition"] = f'attachment; filename="tax_return_{form.calculation_id}.pdf"'
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    
+    return StreamingResponse(
+        iter_file_range(form.pdf_file_path, start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        media_type="application/pdf",
+        headers=headers
+    )
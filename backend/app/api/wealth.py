@@ -1,10 +1,17 @@
-﻿from fastapi import APIRouter, Depends, HTTPException
+﻿from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List, Dict
 from app.db.session import get_db
 from app.db.models import User, WealthStatement
 from app.api.auth import get_current_active_user
+from app.core.config import settings
+from app.services.wealth_service import (
+    line_items_from_input, get_or_create_statement, replace_line_items, refresh_totals,
+    statement_payload, iter_import_rows, import_line_items, wealth_delta
+)
+from app.services.calculation_writer import calculation_writer
+from app.services.reconciliation_service import reconcile
 
 router = APIRouter()
 
@@ -27,52 +34,78 @@ def create_wealth_statement(
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    # Calculate totals
-    total_assets = (
-        sum([p.get('value', 0) for p in wealth_data.properties]) +
-        sum([v.get('value', 0) for v in wealth_data.vehicles]) +
-        sum([a.get('balance', 0) for a in wealth_data.bank_accounts]) +
-        sum([i.get('value', 0) for i in wealth_data.investments]) +
-        wealth_data.gold_silver +
-        wealth_data.cash_in_hand +
-        sum([a.get('value', 0) for a in wealth_data.other_assets])
-    )
-    
-    total_liabilities = (
-        sum([l.get('amount', 0) for l in wealth_data.loans]) +
-        wealth_data.credit_cards +
-        sum([l.get('amount', 0) for l in wealth_data.other_liabilities])
-    )
+    # One statement per tax year: posting again replaces that year's line items
+    statement = get_or_create_statement(db, current_user.id, wealth_data.tax_year)
+    replace_line_items(db, statement, line_items_from_input(wealth_data.model_dump()))
+    refresh_totals(db, statement)
+    db.commit()
     
-    net_wealth = total_assets - total_liabilities
+    return {
+        "message": "Wealth statement created successfully",
+        "total_assets": statement.total_assets,
+        "total_liabilities": statement.total_liabilities,
+        "net_wealth": statement.net_wealth
+    }
+
+@router.post("/{tax_year}/import")
+def import_wealth_items(
+    tax_year: int,
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    filename = (file.filename or "").lower()
+    if filename.endswith((".ndjson", ".jsonl")):
+        fmt = "ndjson"
+    elif filename.endswith(".json"):
+        fmt = "json"
+    elif filename.endswith(".csv"):
+        fmt = "csv"
+    else:
+        raise HTTPException(status_code=400, detail="Upload a CSV, JSON or NDJSON file")
     
-    wealth_statement = WealthStatement(
-        user_id=current_user.id,
-        tax_year=wealth_data.tax_year,
-        properties=wealth_data.properties,
-        vehicles=wealth_data.vehicles,
-        bank_accounts=wealth_data.bank_accounts,
-        investments=wealth_data.investments,
-        gold_silver=wealth_data.gold_silver,
-        cash_in_hand=wealth_data.cash_in_hand,
-        other_assets=wealth_data.other_assets,
-        loans=wealth_data.loans,
-        credit_cards=wealth_data.credit_cards,
-        other_liabilities=wealth_data.other_liabilities,
-        total_assets=total_assets,
-        total_liabilities=total_liabilities,
-        net_wealth=net_wealth
-    )
+    statement = get_or_create_statement(db, current_user.id, tax_year)
+    try:
+        imported, errors = import_line_items(
+            db, statement, iter_import_rows(file.file, fmt), settings.WEALTH_IMPORT_BATCH_SIZE
+        )
+    except (ValueError, UnicodeDecodeError) as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Could not read import file: {e}")
     
-    db.add(wealth_statement)
+    refresh_totals(db, statement)
     db.commit()
-    db.refresh(wealth_statement)
     
     return {
-        "message": "Wealth statement created successfully",
-        "total_assets": total_assets,
-        "total_liabilities": total_liabilities,
-        "net_wealth": net_wealth
+        "message": "Wealth items imported",
+        "imported": imported,
+        "errors": errors,
+        "total_assets": statement.total_assets,
+        "total_liabilities": statement.total_liabilities,
+        "net_wealth": statement.net_wealth
+    }
+
+@router.get("/delta")
+def get_wealth_delta(
+    from_year: int,
+    to_year: int,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    return wealth_delta(db, current_user.id, from_year, to_year)
+
+@router.get("/reconciliation")
+def get_wealth_reconciliation(
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    # Make sure buffered calculator results are visible to the query
+    calculation_writer.flush()
+    pairs = reconcile(db, user_id=current_user.id)
+    
+    return {
+        "pairs": pairs,
+        "flagged": sum(1 for pair in pairs if pair["flagged"])
     }
 
 @router.get("/{tax_year}")
@@ -89,4 +122,4 @@ def get_wealth_statement(
     if not statement:
         raise HTTPException(status_code=404, detail="Wealth statement not found")
     
-    return statement
+    return statement_payload(db, statement)
@@ -11,7 +11,39 @@ class Settings(BaseSettings):
     GROQ_API_KEY: Optional[str] = None
     GROQ_MODEL: str = "llama-3.3-70b-versatile"
     UPLOAD_DIR: str = "./uploads"
+    FORMS_DIR: str = "./forms"
     MAX_FILE_SIZE: int = 10485760
+    UPLOAD_CHUNK_SIZE: int = 1048576
+    UPLOAD_FORM_OVERHEAD: int = 65536  # multipart boundaries and form fields on top of the file
+    BATCH_MAX_FILES: int = 200
+    BATCH_MAX_UPLOAD_SIZE: int = 104857600  # whole multipart request, ZIPs included
+    BATCH_MAX_EXTRACTED_SIZE: int = 524288000  # decompressed bytes across one batch
+    INGEST_WORKERS: int = 4
+    OCR_LANG: str = "eng"
+    OCR_TESSERACT_CONFIG: str = "--oem 1 --psm 6 -c preserve_interword_spaces=1"  # LSTM engine, one uniform block keeps statement rows together
+    OCR_TARGET_DPI: int = 300
+    OCR_ASSUMED_PAGE_WIDTH_INCHES: float = 8.27  # A4, used when the image carries no DPI
+    OCR_CROP_TABLE: bool = False
+    PROFILING_SAMPLE_RATE: float = 0.0  # share of /api requests profiled automatically
+    PROFILING_ALLOW_HEADER: bool = False  # when enabled, admins can send "X-Profile: 1" on any request
+    PROFILING_INTERVAL_SECONDS: float = 0.005
+    PROFILE_DIR: str = "./profiles"
+    PROFILE_KEEP: int = 50
+    RAG_MODE: str = "hybrid"  # "dense", "sparse" (no transformer loaded) or "hybrid"
+    RAG_RRF_K: int = 60
+    VECTOR_STORE_DIR: str = "./vector_store"
+    PAYROLL_CHUNK_SIZE: int = 1000
+    PAYROLL_MAX_UPLOAD_SIZE: int = 52428800
+    SCENARIO_MAX_POINTS: int = 100000  # income_steps x mixes per /scenarios request
+    WEALTH_IMPORT_BATCH_SIZE: int = 1000
+    RECONCILIATION_TOLERANCE: float = 100000
+    RECONCILIATION_TOLERANCE_RATE: float = 0.05
+    CALC_WRITE_BATCH_SIZE: int = 500
+    CALC_FLUSH_INTERVAL_SECONDS: float = 2.0
+    CALC_MEMO_SIZE: int = 10000
+    RAG_CHUNK_WORDS: int = 120
+    RAG_CHUNK_OVERLAP: int = 20
+    RAG_EMBED_BATCH_SIZE: int = 64
     
     class Config:
         env_file = ".env"
@@ -32,3 +64,10 @@ TAX_SLABS = {
         {"min": 12000001, "max": 999999999, "rate": 0.35, "fixed": 2955000}
     ]
 }
+
+# Caps on deductible spending used by the scenario optimizer
+DEDUCTION_CAPS = {
+    "life_insurance": 300000,      # Rs. per year
+    "charity_rate": 0.30,          # share of taxable income
+    "pension_rate": 0.20           # share of taxable income (approved pension funds)
+}
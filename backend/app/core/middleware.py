@@ -0,0 +1,177 @@
+﻿import random
+import time
+from typing import Dict, Optional
+import anyio
+from fastapi import HTTPException
+from starlette.types import ASGIApp, Receive, Scope, Send
+from app.core.config import settings
+from app.core.metrics import request_latency
+from app.core.profiling import StackSampler, save_profile, profile_slot
+from app.core.security import decode_access_token
+
+class BodySizeLimitMiddleware:
+    # Starlette spools the whole multipart body before the handler runs, so the
+    # size limit has to be enforced while the bytes are still being received
+    def __init__(self, app: ASGIApp, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+    
+    def _limit_for(self, path: str):
+        for prefix, limit in self.limits.items():
+            if path.startswith(prefix):
+                return limit
+        return None
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        limit = self._limit_for(scope["path"])
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            await self._reject(send, limit)
+            return
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Surfaces through FastAPI's body parsing as a normal 413
+                    raise HTTPException(status_code=413, detail=f"Request body exceeds {limit} bytes")
+            return message
+        
+        await self.app(scope, limited_receive, send)
+    
+    async def _reject(self, send: Send, limit: int):
+        body = f'{{"detail":"Request body exceeds {limit} bytes"}}'.encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close")
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+class MetricsMiddleware:
+    # Labels by route template (/api/documents/{document_id}/text), not the raw
+    # path, so the number of series stays bounded
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        status_code = 500
+        
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            request_latency.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status_code
+            )
+
+class ProfilingMiddleware:
+    # Only installed when sampling or the admin header is enabled; requests
+    # that are not picked pay one header scan and no sampling thread
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    def _token_payload(self, headers: Dict[bytes, bytes]) -> Optional[dict]:
+        authorization = headers.get(b"authorization", b"").decode("latin-1")
+        if not authorization.lower().startswith("bearer "):
+            return None
+        return decode_access_token(authorization[7:])
+    
+    def _is_admin(self, payload: dict) -> bool:
+        from app.db.session import SessionLocal
+        from app.db.models import User
+        db = SessionLocal()
+        try:
+            user = db.query(User).filter(User.email == payload.get("sub")).first()
+            return bool(user and user.is_admin)
+        finally:
+            db.close()
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+        
+        headers = dict(scope.get("headers") or [])
+        trigger = None
+        if settings.PROFILING_ALLOW_HEADER and headers.get(b"x-profile") == b"1":
+            trigger = "header"
+        elif settings.PROFILING_SAMPLE_RATE > 0 and random.random() < settings.PROFILING_SAMPLE_RATE:
+            trigger = "sampled"
+        
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+        
+        payload = self._token_payload(headers)
+        if trigger == "header":
+            # Anonymous or bad tokens are turned away before any database lookup
+            if not payload or not await anyio.to_thread.run_sync(self._is_admin, payload):
+                await self.app(scope, receive, send)
+                return
+        
+        if not profile_slot.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+        
+        status_code = 500
+        
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        sampler = StackSampler(settings.PROFILING_INTERVAL_SECONDS)
+        started_at = time.time()
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            sampler.stop()
+            duration_ms = round((time.perf_counter() - start) * 1000, 2)
+            profile_slot.release()
+            route = scope.get("route")
+            metadata = {
+                "route": getattr(route, "path", scope["path"]),
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status_code,
+                "user_id": (payload or {}).get("user_id"),
+                "trigger": trigger,
+                "started_at": started_at,
+                "duration_ms": duration_ms
+            }
+            await anyio.to_thread.run_sync(save_profile, sampler, metadata)
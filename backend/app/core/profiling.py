@@ -0,0 +1,111 @@
+﻿import json
+import os
+import re
+import sys
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+from app.core.config import settings
+
+PROFILE_ID_PATTERN = re.compile(r"^[0-9]{8}T[0-9]{6}_[0-9a-f]{8}$")
+# Leaf frames of threads parked waiting for work; they would swamp the profile
+IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+class StackSampler:
+    # Samples every thread's stack with sys._current_frames() and counts
+    # folded stacks ("root;caller;leaf count"), the input format of
+    # flamegraph.pl and speedscope. Sync handlers run on threadpool workers,
+    # so all threads are sampled; concurrent requests show up too.
+    
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+    
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+                if leaf in IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(thread_names.get(ident, f"thread-{ident}"))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+    
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+def _profile_paths(profile_id: str):
+    base = os.path.join(settings.PROFILE_DIR, profile_id)
+    return f"{base}.folded", f"{base}.json"
+
+def save_profile(sampler: StackSampler, metadata: Dict) -> str:
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    profile_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    folded_path, meta_path = _profile_paths(profile_id)
+    
+    with open(folded_path, "w", encoding="utf-8") as f:
+        f.write(sampler.folded())
+    metadata = dict(metadata, id=profile_id, samples=sampler.samples, interval_ms=sampler.interval * 1000)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(metadata, f)
+    
+    _prune_profiles()
+    print(f" Saved profile {profile_id} for {metadata.get('method')} {metadata.get('route')} ({metadata.get('duration_ms')} ms)")
+    return profile_id
+
+def _prune_profiles():
+    meta_files = sorted(name for name in os.listdir(settings.PROFILE_DIR) if name.endswith(".json"))
+    excess = len(meta_files) - settings.PROFILE_KEEP
+    for name in meta_files[:max(0, excess)]:
+        for path in _profile_paths(name[:-len(".json")]):
+            if os.path.exists(path):
+                os.remove(path)
+
+def list_profiles() -> List[Dict]:
+    if not os.path.isdir(settings.PROFILE_DIR):
+        return []
+    profiles = []
+    # Ids start with a UTC timestamp, so name order is age order
+    for name in sorted(os.listdir(settings.PROFILE_DIR), reverse=True):
+        if name.endswith(".json"):
+            with open(os.path.join(settings.PROFILE_DIR, name), encoding="utf-8") as f:
+                profiles.append(json.load(f))
+    return profiles
+
+def profile_file_path(profile_id: str) -> Optional[str]:
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    folded_path, _ = _profile_paths(profile_id)
+    return folded_path if os.path.exists(folded_path) else None
+
+# Only one request is profiled at a time so sampling cost stays bounded
+profile_slot = threading.Semaphore(1)
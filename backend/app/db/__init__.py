@@ -1,4 +1,4 @@
 ﻿from app.db.base import Base
-from app.db.models import User, Document, ExtractedData, TaxCalculation, TaxReturnForm
+from app.db.models import User, Document, DocumentBatch, ExtractedData, DocumentText, TaxCalculation, TaxReturnForm, WealthStatement, WealthLineItem
 
-__all__ = ["Base", "User", "Document", "ExtractedData", "TaxCalculation", "TaxReturnForm"]
+__all__ = ["Base", "User", "Document", "DocumentBatch", "ExtractedData", "DocumentText", "TaxCalculation", "TaxReturnForm", "WealthStatement", "WealthLineItem"]
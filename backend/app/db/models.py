@@ -1,5 +1,5 @@
-﻿from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean, JSON
-from sqlalchemy.orm import relationship
+﻿from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean, JSON, LargeBinary, UniqueConstraint, Index
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 from app.db.base import Base
 
@@ -13,6 +13,7 @@ class User(Base):
     cnic = Column(String, unique=True)
     phone_number = Column(String)
     is_verified = Column(Boolean, default=False)
+    is_admin = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     last_login = Column(DateTime)
     
@@ -29,6 +30,7 @@ class Document(Base):
     file_path = Column(String, nullable=False)
     original_filename = Column(String)
     file_size_kb = Column(Integer)
+    batch_id = Column(Integer, ForeignKey("document_batches.id"), index=True)
     upload_date = Column(DateTime, default=datetime.utcnow)
     processing_status = Column(String, default="uploaded")
     ocr_confidence = Column(Float)
@@ -36,6 +38,19 @@ class Document(Base):
     
     user = relationship("User", back_populates="documents")
     extracted_data = relationship("ExtractedData", back_populates="document", cascade="all, delete-orphan")
+    text_blob = relationship("DocumentText", back_populates="document", uselist=False, cascade="all, delete-orphan")
+    batch = relationship("DocumentBatch", back_populates="documents")
+
+class DocumentBatch(Base):
+    __tablename__ = "document_batches"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    document_type = Column(String, nullable=False)
+    total_documents = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    documents = relationship("Document", back_populates="batch")
 
 class ExtractedData(Base):
     __tablename__ = "extracted_data"
@@ -51,8 +66,30 @@ class ExtractedData(Base):
     
     document = relationship("Document", back_populates="extracted_data")
 
+class DocumentText(Base):
+    __tablename__ = "document_texts"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, unique=True)
+    codec = Column(String, default="zlib")
+    content_hash = Column(String, index=True)
+    page_count = Column(Integer, default=0)
+    # [offset, length] of each page's compressed frame inside `content`
+    page_frames = Column(JSON, default=list)
+    raw_size = Column(Integer, default=0)
+    compressed_size = Column(Integer, default=0)
+    # Out-of-row blob, only loaded when the text is actually requested
+    content = deferred(Column(LargeBinary))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    document = relationship("Document", back_populates="text_blob")
+
 class TaxCalculation(Base):
     __tablename__ = "tax_calculations"
+    __table_args__ = (
+        # Identical calculator inputs are stored once per user and tax year
+        UniqueConstraint("user_id", "tax_year", "input_hash", name="uq_tax_calculations_input"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -66,6 +103,9 @@ class TaxCalculation(Base):
     tax_liability = Column(Float, default=0)
     calculation_date = Column(DateTime, default=datetime.utcnow)
     status = Column(String, default="draft")
+    input_hash = Column(String, index=True)
+    # Set on payroll rows: the employer's reference for the employee
+    employee_id = Column(String, nullable=True)
     
     user = relationship("User", back_populates="tax_calculations")
     tax_form = relationship("TaxReturnForm", back_populates="calculation", uselist=False, cascade="all, delete-orphan")
@@ -76,6 +116,8 @@ class TaxReturnForm(Base):
     id = Column(Integer, primary_key=True, index=True)
     calculation_id = Column(Integer, ForeignKey("tax_calculations.id"), nullable=False, unique=True)
     pdf_file_path = Column(String)
+    status = Column(String, default="pending")
+    content_hash = Column(String, index=True)
     generation_date = Column(DateTime, default=datetime.utcnow)
     download_count = Column(Integer, default=0)
     
@@ -83,26 +125,15 @@ class TaxReturnForm(Base):
 
 class WealthStatement(Base):
     __tablename__ = "wealth_statements"
+    __table_args__ = (
+        UniqueConstraint("user_id", "tax_year", name="uq_wealth_statements_user_year"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     tax_year = Column(Integer, nullable=False)
     
-    # Assets
-    properties = Column(JSON, default=list)
-    vehicles = Column(JSON, default=list)
-    bank_accounts = Column(JSON, default=list)
-    investments = Column(JSON, default=list)
-    gold_silver = Column(Float, default=0)
-    cash_in_hand = Column(Float, default=0)
-    other_assets = Column(JSON, default=list)
-    
-    # Liabilities
-    loans = Column(JSON, default=list)
-    credit_cards = Column(Float, default=0)
-    other_liabilities = Column(JSON, default=list)
-    
-    # Totals
+    # Totals, recomputed with SQL aggregates over the line items
     total_assets = Column(Float, default=0)
     total_liabilities = Column(Float, default=0)
     net_wealth = Column(Float, default=0)
@@ -111,3 +142,26 @@ class WealthStatement(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     user = relationship("User", back_populates="wealth_statements")
+    line_items = relationship("WealthLineItem", back_populates="statement", cascade="all, delete-orphan")
+
+class WealthLineItem(Base):
+    __tablename__ = "wealth_line_items"
+    __table_args__ = (
+        # Upsert key for bulk imports
+        UniqueConstraint("statement_id", "category", "external_ref", name="uq_wealth_line_items_ref"),
+        Index("ix_wealth_line_items_user_year_kind", "user_id", "tax_year", "kind"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    statement_id = Column(Integer, ForeignKey("wealth_statements.id", ondelete="CASCADE"), nullable=False, index=True)
+    # Denormalized from the statement so cross-year aggregates need no join
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    tax_year = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)  # "asset" or "liability"
+    category = Column(String, nullable=False)
+    external_ref = Column(String, nullable=False)
+    description = Column(String)
+    amount = Column(Float, nullable=False, default=0)
+    details = Column(JSON, default=dict)
+    
+    statement = relationship("WealthStatement", back_populates="line_items")
@@ -1,6 +1,8 @@
-﻿from sqlalchemy import create_engine
+﻿import time
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
+from app.core.metrics import stage_latency
 from app.db.base import Base
 
 # PostgreSQL engine (no check_same_thread needed!)
@@ -12,6 +14,21 @@ engine = create_engine(
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Commit latency (flush + COMMIT round trip) for every session, request or background
+@event.listens_for(SessionLocal, "before_commit")
+def _start_commit_timer(session):
+    session.info["commit_started"] = time.perf_counter()
+
+@event.listens_for(SessionLocal, "after_commit")
+def _observe_commit(session):
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        stage_latency.observe(time.perf_counter() - started, stage="db_commit")
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_commit_timer(session):
+    session.info.pop("commit_started", None)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -19,7 +36,17 @@ def get_db():
     finally:
         db.close()
 
+def dialect_insert(table):
+    # INSERT that supports on_conflict_do_nothing/do_update on both backends we run on
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
 def init_db():
     from app.db import models
+    from app.services.search_service import create_search_index
     Base.metadata.create_all(bind=engine)
+    create_search_index(engine)
     print(' PostgreSQL database initialized successfully!')
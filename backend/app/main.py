@@ -1,6 +1,15 @@
 ﻿from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api import auth, documents, tax, wealth
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy import text
+from app.api import auth, documents, tax, wealth, admin
+from app.core.config import settings
+from app.core.metrics import registry
+from app.core.middleware import BodySizeLimitMiddleware, MetricsMiddleware, ProfilingMiddleware
+from app.db.session import SessionLocal
+from app.services.rag_service import tax_kb
+from app.services.calculation_writer import calculation_writer
+from app.services.ingestion_service import start_ingestion, stop_ingestion
 
 app = FastAPI(
     title="Tax Filing Automation System",
@@ -14,12 +23,41 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Timing headers the frontend reads from cross-origin responses
+    expose_headers=["X-Elapsed-Ms", "X-Upload-Bytes-Per-Second"],
 )
 
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={
+        "/api/documents/upload": settings.MAX_FILE_SIZE + settings.UPLOAD_FORM_OVERHEAD,
+        "/api/documents/batch": settings.BATCH_MAX_UPLOAD_SIZE,
+        "/api/tax/payroll/withholding": settings.PAYROLL_MAX_UPLOAD_SIZE
+    }
+)
+
+if settings.PROFILING_SAMPLE_RATE > 0 or settings.PROFILING_ALLOW_HEADER:
+    app.add_middleware(ProfilingMiddleware)
+
+# Added last so it is outermost and times the whole stack
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(documents.router, prefix="/api/documents", tags=["Documents"])
 app.include_router(tax.router, prefix="/api/tax", tags=["Tax Calculation"])
 app.include_router(wealth.router, prefix="/api/wealth", tags=["Wealth Statement"])
+app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
+
+@app.on_event("startup")
+def start_background_writers():
+    calculation_writer.start()
+    start_ingestion()
+
+@app.on_event("shutdown")
+def flush_background_writers():
+    # Drain buffered tax calculation history before the process exits
+    calculation_writer.stop()
+    stop_ingestion()
 
 @app.get("/")
 async def root():
@@ -30,6 +68,44 @@ async def root():
         "features": ["Authentication", "Tax Calculation", "Document OCR", "AI Chatbot with RAG", "Wealth Statement"]
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
-async def health_check():
-    return {"status": "healthy", "database": "connected", "rag": "enabled"}
+def health_check():
+    healthy = True
+    
+    try:
+        db = SessionLocal()
+        try:
+            db.execute(text("SELECT 1"))
+        finally:
+            db.close()
+        database = "connected"
+    except Exception as e:
+        # Unauthenticated endpoint: keep connection details out of the response
+        print(f" Health check database error: {e}")
+        healthy = False
+        database = "error"
+    
+    documents_indexed = len(tax_kb.documents)
+    if tax_kb.uses_dense and (tax_kb.index is None or tax_kb.index.ntotal == 0):
+        healthy = False
+        rag = "dense index empty"
+    elif tax_kb.uses_sparse and not tax_kb.sparse_index.doc_lengths:
+        healthy = False
+        rag = "sparse index empty"
+    else:
+        rag = "enabled"
+    
+    return JSONResponse(
+        status_code=200 if healthy else 503,
+        content={
+            "status": "healthy" if healthy else "unhealthy",
+            "database": database,
+            "rag": rag,
+            "rag_mode": tax_kb.mode,
+            "documents_indexed": documents_indexed
+        }
+    )
@@ -1,36 +1,42 @@
 ﻿import os
+from fastapi.concurrency import run_in_threadpool
 from groq import Groq
 from app.core.config import settings
-from app.services.rag_service import tax_kb
+from app.core.metrics import stage_timer
+from typing import Optional
+from app.services.rag_service import retrieve
 
 client = None
 if settings.GROQ_API_KEY:
     client = Groq(api_key=settings.GROQ_API_KEY)
 
-async def ask_tax_question(question: str) -> str:
+async def ask_tax_question(question: str, user_id: Optional[int] = None) -> str:
     if not client:
         return "AI service not configured. Please set GROQ_API_KEY in .env file."
     
-    # Use RAG to get relevant context
-    relevant_docs = tax_kb.search(question, k=3)
+    # Use RAG over the FBR knowledge base and the user's own documents
+    with stage_timer("rag_retrieve"):
+        # BM25 scoring and embedding are CPU-bound: keep them off the event loop
+        relevant_docs = await run_in_threadpool(retrieve, question, user_id=user_id, k=5)
     context = "\n".join([doc['text'] for doc in relevant_docs])
     
     system_prompt = f'''You are a Pakistani tax expert assistant. Use this knowledge to answer questions:
 
 {context}
 
-Provide accurate, helpful answers about Pakistani tax rules and FBR regulations.'''
+Context lines may come from the user's own uploaded statements. Provide accurate, helpful answers about Pakistani tax rules, FBR regulations and the user's documents.'''
     
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": question}
-            ],
-            model=settings.GROQ_MODEL,
-            temperature=0.3,
-            max_tokens=500
-        )
+        with stage_timer("groq_completion"):
+            chat_completion = client.chat.completions.create(
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": question}
+                ],
+                model=settings.GROQ_MODEL,
+                temperature=0.3,
+                max_tokens=500
+            )
         
         answer = chat_completion.choices[0].message.content
         
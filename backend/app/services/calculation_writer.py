@@ -0,0 +1,115 @@
+﻿import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings, TAX_SLABS
+from app.db.models import TaxCalculation
+from app.db.session import SessionLocal, dialect_insert
+
+# Part of every input hash, so editing the slab table starts a fresh history
+SLABS_VERSION = hashlib.sha256(json.dumps(TAX_SLABS, sort_keys=True).encode()).hexdigest()[:12]
+
+def tax_input_hash(inputs: Dict[str, float]) -> str:
+    normalized = {name: round(float(value), 2) for name, value in sorted(inputs.items())}
+    payload = json.dumps({"inputs": normalized, "slabs": SLABS_VERSION}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class CalculationWriter:
+    # Memoizes results by (user_id, tax_year, input_hash) and writes history
+    # rows behind the request in bulk batches from a background thread
+    
+    def __init__(self, batch_size: int, flush_interval: float, memo_size: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.memo_size = memo_size
+        self.max_pending = batch_size * 20
+        self._pending: List[Dict] = []
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="calculation-writer", daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        self.flush()
+    
+    def lookup(self, key: Tuple) -> Optional[Dict]:
+        with self._lock:
+            result = self._memo.get(key)
+            if result is not None:
+                self._memo.move_to_end(key)
+            return result
+    
+    def submit(self, key: Tuple, result: Dict, row: Dict):
+        if not self._thread:
+            self.start()
+        
+        with self._lock:
+            self._memo[key] = result
+            if len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+            self._pending.append(row)
+            pending = len(self._pending)
+        
+        if pending >= self.batch_size:
+            self._wakeup.set()
+    
+    def flush(self) -> int:
+        # The swap happens under the flush lock, so a caller that finds nothing
+        # pending has still waited out an insert already in flight: a listing
+        # that flushes first always sees the caller's own rows
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+            
+            db = SessionLocal()
+            try:
+                statement = dialect_insert(TaxCalculation).on_conflict_do_nothing(
+                    index_elements=["user_id", "tax_year", "input_hash"]
+                )
+                for start in range(0, len(rows), self.batch_size):
+                    db.execute(statement, rows[start:start + self.batch_size])
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                print(f" Calculation history flush failed: {e}")
+                with self._lock:
+                    # Keep the rows for the next attempt, but never grow without bound;
+                    # dropped rows leave the memo too so a repeat request re-queues them
+                    queued = rows + self._pending
+                    for row in queued[:-self.max_pending]:
+                        self._memo.pop((row["user_id"], row["tax_year"], row["input_hash"]), None)
+                    self._pending = queued[-self.max_pending:]
+                return 0
+            finally:
+                db.close()
+        
+        return len(rows)
+    
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+calculation_writer = CalculationWriter(
+    batch_size=settings.CALC_WRITE_BATCH_SIZE,
+    flush_interval=settings.CALC_FLUSH_INTERVAL_SECONDS,
+    memo_size=settings.CALC_MEMO_SIZE
+)
@@ -0,0 +1,79 @@
+﻿import hashlib
+import zlib
+from typing import List, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session, undefer
+from app.db.models import DocumentText
+
+CODEC = "zlib"
+COMPRESSION_LEVEL = 6
+
+def compress_pages(pages: List[str]) -> Tuple[bytes, List[List[int]], int]:
+    # Every page is its own zlib frame so a single page can be range-read
+    # out of the blob without inflating the whole document
+    blob = bytearray()
+    frames = []
+    raw_size = 0
+    
+    for page in pages:
+        raw = page.encode('utf-8')
+        raw_size += len(raw)
+        frame = zlib.compress(raw, COMPRESSION_LEVEL)
+        frames.append([len(blob), len(frame)])
+        blob.extend(frame)
+    
+    return bytes(blob), frames, raw_size
+
+def save_document_text(db: Session, document_id: int, pages: List[str]) -> DocumentText:
+    blob, frames, raw_size = compress_pages(pages)
+    content_hash = hashlib.sha256("\f".join(pages).encode('utf-8')).hexdigest()
+    
+    stored = DocumentText(
+        document_id=document_id,
+        codec=CODEC,
+        content_hash=content_hash,
+        page_count=len(pages),
+        page_frames=frames,
+        raw_size=raw_size,
+        compressed_size=len(blob),
+        content=blob
+    )
+    
+    db.add(stored)
+    return stored
+
+def load_document_pages(db: Session, document_id: int) -> Optional[List[str]]:
+    stored = db.query(DocumentText).options(undefer(DocumentText.content)).filter(
+        DocumentText.document_id == document_id
+    ).first()
+    
+    if not stored:
+        return None
+    
+    blob = stored.content or b""
+    return [
+        zlib.decompress(blob[offset:offset + length]).decode('utf-8')
+        for offset, length in stored.page_frames
+    ]
+
+def load_document_text(db: Session, document_id: int) -> Optional[str]:
+    pages = load_document_pages(db, document_id)
+    if pages is None:
+        return None
+    return "\n".join(page for page in pages if page)
+
+def load_document_page(db: Session, document_id: int, page: int) -> Optional[str]:
+    stored = db.query(DocumentText.page_frames).filter(
+        DocumentText.document_id == document_id
+    ).first()
+    
+    if not stored or page < 0 or page >= len(stored.page_frames):
+        return None
+    
+    offset, length = stored.page_frames[page]
+    # substr on bytea/BLOB is 1-based; only this page's frame leaves the database
+    frame = db.query(
+        func.substr(DocumentText.content, offset + 1, length)
+    ).filter(DocumentText.document_id == document_id).scalar()
+    
+    return zlib.decompress(bytes(frame)).decode('utf-8')
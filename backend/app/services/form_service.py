@@ -0,0 +1,237 @@
+﻿import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.db.models import TaxCalculation, TaxReturnForm, WealthStatement, WealthLineItem
+from app.db.session import SessionLocal
+from app.services.wealth_service import CATEGORY_LABELS
+
+os.makedirs(settings.FORMS_DIR, exist_ok=True)
+
+# Bump when the layout changes so cached PDFs are re-rendered
+TEMPLATE_VERSION = "1"
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN_X, TOP_Y, LINE_HEIGHT = 50, 790, 15
+LINES_PER_PAGE = (TOP_Y - 60) // LINE_HEIGHT
+
+# Fixed part of the return: (font, size, label, field). Compiled once into a
+# content-stream template so a render is a single bytes %-substitution.
+SUMMARY_LAYOUT = [
+    ("F2", 16, "Income Tax Return (Form 114)", None),
+    ("F1", 10, "Tax year", "tax_year"),
+    ("F1", 10, "Taxpayer", "full_name"),
+    ("F1", 10, "CNIC", "cnic"),
+    ("F1", 10, "", None),
+    ("F2", 12, "Income", None),
+    ("F1", 10, "Salary income", "salary_income"),
+    ("F1", 10, "Business income", "business_income"),
+    ("F1", 10, "Other income", "other_income"),
+    ("F1", 10, "Total income", "total_income"),
+    ("F1", 10, "Deductions", "total_deductions"),
+    ("F1", 10, "Taxable income", "taxable_income"),
+    ("F2", 11, "Tax liability", "tax_liability"),
+    ("F1", 10, "", None),
+    ("F2", 12, "Wealth statement", None),
+    ("F1", 10, "Total assets", "total_assets"),
+    ("F1", 10, "Total liabilities", "total_liabilities"),
+    ("F2", 11, "Net wealth", "net_wealth"),
+    ("F1", 10, "", None),
+]
+
+def _escape(value) -> bytes:
+    text = str(value).encode("latin-1", errors="replace")
+    return text.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+def _compile_summary() -> bytes:
+    ops = []
+    for row, (font, size, label, field) in enumerate(SUMMARY_LAYOUT):
+        y = TOP_Y - row * LINE_HEIGHT
+        text = _escape(label) + (b": %%(%s)s" % field.encode() if field else b"")
+        ops.append(b"BT /%s %d Tf %d %d Td (%s) Tj ET" % (font.encode(), size, MARGIN_X, y, text))
+    return b"\n".join(ops)
+
+SUMMARY_TEMPLATE = _compile_summary()
+
+def _text_op(font: str, size: int, row: int, text: str) -> bytes:
+    y = TOP_Y - row * LINE_HEIGHT
+    return b"BT /%s %d Tf %d %d Td (%s) Tj ET" % (font.encode(), size, MARGIN_X, y, _escape(text))
+
+def _money(amount) -> str:
+    return f"Rs. {float(amount or 0):,.2f}"
+
+def build_pdf(page_streams: List[bytes]) -> bytes:
+    # 1 catalog, 2 page tree, 3-4 fonts, then a (page, content) pair per page
+    page_ids = [5 + 2 * i for i in range(len(page_streams))]
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % pid for pid in page_ids), len(page_ids)),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+    ]
+    for page_id, stream in zip(page_ids, page_streams):
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+            b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>"
+            % (PAGE_WIDTH, PAGE_HEIGHT, page_id + 1)
+        )
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream) + 1, stream))
+    
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(out)
+
+def collect_form_data(db: Session, calculation: TaxCalculation) -> Dict:
+    user = calculation.user
+    statement = db.query(WealthStatement).filter(
+        WealthStatement.user_id == calculation.user_id,
+        WealthStatement.tax_year == calculation.tax_year
+    ).first()
+    
+    data = {
+        "template_version": TEMPLATE_VERSION,
+        "tax_year": calculation.tax_year,
+        "full_name": user.full_name,
+        "cnic": user.cnic or "-",
+        "salary_income": calculation.salary_income,
+        "business_income": calculation.business_income,
+        "other_income": calculation.other_income,
+        "total_income": calculation.total_income,
+        "total_deductions": calculation.total_deductions,
+        "taxable_income": calculation.taxable_income,
+        "tax_liability": calculation.tax_liability,
+        "total_assets": statement.total_assets if statement else 0,
+        "total_liabilities": statement.total_liabilities if statement else 0,
+        "net_wealth": statement.net_wealth if statement else 0,
+        "wealth_items": []
+    }
+    
+    if statement:
+        items = db.query(WealthLineItem).filter(
+            WealthLineItem.statement_id == statement.id
+        ).order_by(WealthLineItem.kind, WealthLineItem.category, WealthLineItem.id).all()
+        data["wealth_items"] = [
+            [CATEGORY_LABELS.get(item.category, item.category), item.description or "", item.amount]
+            for item in items
+        ]
+    
+    return data
+
+def content_hash(data: Dict) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+def render_form_pdf(data: Dict) -> bytes:
+    money_fields = ("salary_income", "business_income", "other_income", "total_income", "total_deductions",
+                    "taxable_income", "tax_liability", "total_assets", "total_liabilities", "net_wealth")
+    # bytes %-formatting looks mappings up by bytes keys
+    values = {
+        key.encode(): _escape(_money(value) if key in money_fields else value)
+        for key, value in data.items() if key != "wealth_items"
+    }
+    
+    pages = [[SUMMARY_TEMPLATE % values]]
+    row = len(SUMMARY_LAYOUT)
+    if data["wealth_items"]:
+        pages[0].append(_text_op("F2", 12, row, "Assets and liabilities"))
+        row += 1
+    
+    for label, name, amount in data["wealth_items"]:
+        if row >= LINES_PER_PAGE:
+            pages.append([])
+            row = 0
+        line = f"{label}{' - ' + name if name else ''}: {_money(amount)}"
+        pages[-1].append(_text_op("F1", 10, row, line))
+        row += 1
+    
+    return build_pdf([b"\n".join(ops) for ops in pages])
+
+def render_text_pdf(pages: List[List[str]], size: int = 9) -> bytes:
+    # Plain text pages in the same PDF dialect; lines past LINES_PER_PAGE
+    # flow onto an extra page
+    streams = []
+    for lines in pages:
+        for start in range(0, max(len(lines), 1), LINES_PER_PAGE):
+            chunk = lines[start:start + LINES_PER_PAGE]
+            streams.append(b"\n".join(_text_op("F1", size, row, line) for row, line in enumerate(chunk)))
+    return build_pdf(streams)
+
+def form_file_path(form_hash: str) -> str:
+    return os.path.join(settings.FORMS_DIR, f"{form_hash}.pdf")
+
+def render_tax_form(form_id: int):
+    # Runs as a background task with its own session
+    db = SessionLocal()
+    try:
+        form = db.query(TaxReturnForm).filter(TaxReturnForm.id == form_id).first()
+        if not form:
+            return
+        
+        data = collect_form_data(db, form.calculation)
+        form_hash = content_hash(data)
+        path = form_file_path(form_hash)
+        
+        tmp_path = None
+        try:
+            if not os.path.exists(path):
+                # Unique temp name: another worker may render the same hash
+                fd, tmp_path = tempfile.mkstemp(dir=settings.FORMS_DIR, suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(render_form_pdf(data))
+                os.replace(tmp_path, path)
+                tmp_path = None
+        except Exception as e:
+            # Same content hash means same bytes, so a concurrent render that
+            # got there first is as good as our own
+            if not os.path.exists(path):
+                print(f" Tax form rendering failed: {e}")
+                form.status = "error"
+                db.commit()
+                return
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        
+        form.content_hash = form_hash
+        form.pdf_file_path = path
+        form.status = "ready"
+        db.commit()
+    finally:
+        db.close()
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    # Single "bytes=start-end" range -> inclusive (start, end); raises ValueError when unsatisfiable
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    if not start_text:
+        length = int(end_text)
+        if length <= 0:
+            raise ValueError("empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(start_text)
+    end = min(int(end_text), size - 1) if end_text else size - 1
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+def iter_file_range(path: str, start: int, end: int, chunk_size: int = 64 * 1024):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
@@ -0,0 +1,172 @@
+﻿import os
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.db.models import Document, ExtractedData
+from app.db.session import SessionLocal
+from app.services.ocr_service import extract_pages, extract_financial_data, sniff_file_type
+from app.services.document_store import save_document_text
+from app.services.search_service import index_document
+from app.services.rag_service import user_documents
+
+ZIP_SIGNATURE = b"PK\x03\x04"
+
+# Created on startup (or first use) and dropped on shutdown, so the app can be
+# started again in the same process, as tests and reloads do
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def _running_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.INGEST_WORKERS, thread_name_prefix="ingest")
+    return _executor
+
+def start_ingestion():
+    with _executor_lock:
+        _running_executor()
+
+def stop_ingestion():
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    # Let in-flight document extraction finish writing its results
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+def stored_upload_path(user_id: int, original_filename: str) -> str:
+    # Unique per upload so cleaning up a rejected file never touches another one
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"{user_id}_{timestamp}_{uuid.uuid4().hex[:8]}_{original_filename}"
+    return os.path.join(settings.UPLOAD_DIR, filename)
+
+def process_document(db: Session, document: Document, user_id: int) -> str:
+    document.processing_status = "processing"
+    db.commit()
+    
+    pages = extract_pages(document.file_path)
+    extracted_text = "\n".join(page for page in pages if page)
+    
+    # Full text goes to compressed blob storage; only parsed fields stay in the hot table
+    save_document_text(db, document.id, pages)
+    index_document(db, document.id, user_id, extracted_text)
+    
+    for field_name, field_value in extract_financial_data(extracted_text).items():
+        if field_value is None:
+            continue
+        db.add(ExtractedData(
+            document_id=document.id,
+            field_name=field_name,
+            field_value=str(field_value),
+            confidence_score=0.85,
+            is_validated=False
+        ))
+    
+    document.processing_status = "completed"
+    document.ocr_confidence = 0.85
+    db.commit()
+    db.refresh(document)
+    return extracted_text
+
+def ingest_document(document_id: int):
+    # Runs on the ingestion pool, so it owns its session
+    db = SessionLocal()
+    try:
+        document = db.get(Document, document_id)
+        if document is None:
+            return
+        user_id = document.user_id
+        
+        try:
+            extracted_text = process_document(db, document, user_id)
+        except Exception as e:
+            db.rollback()
+            document.processing_status = "error"
+            document.error_message = str(e)
+            db.commit()
+            print(f" Ingestion failed for document {document_id}: {e}")
+            return
+    finally:
+        db.close()
+    
+    user_documents.add_document(user_id, document_id, extracted_text)
+
+def submit_documents(document_ids: List[int]):
+    # Held while submitting so shutdown never swaps the pool out mid-batch
+    with _executor_lock:
+        executor = _running_executor()
+        for document_id in document_ids:
+            executor.submit(ingest_document, document_id)
+
+def unpack_zip(fileobj, user_id: int, budget: int, max_files: int) -> Tuple[List[Dict], List[Dict], int]:
+    # Entries are streamed to disk one chunk at a time and the decompressed
+    # bytes are counted, so header sizes are never trusted (zip bombs)
+    accepted, rejected = [], []
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        return accepted, [{"filename": "archive", "reason": "Not a valid ZIP archive"}], budget
+    
+    with archive:
+        entries = [
+            info for info in archive.infolist()
+            if not info.is_dir()
+            and not info.filename.startswith("__MACOSX/")
+            and not os.path.basename(info.filename).startswith(".")
+        ]
+        for position, info in enumerate(entries):
+            name = os.path.basename(info.filename)
+            if budget <= 0 or len(accepted) >= max_files:
+                rejected.extend(
+                    {"filename": os.path.basename(rest.filename), "reason": "Batch limit reached"}
+                    for rest in entries[position:]
+                )
+                break
+            if info.file_size > settings.MAX_FILE_SIZE:
+                rejected.append({"filename": name, "reason": f"File exceeds {settings.MAX_FILE_SIZE} bytes"})
+                continue
+            
+            file_path = stored_upload_path(user_id, name)
+            size = 0
+            file_type = None
+            try:
+                with archive.open(info) as source, open(file_path, "wb") as target:
+                    while True:
+                        chunk = source.read(settings.UPLOAD_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        if file_type is None:
+                            file_type = sniff_file_type(chunk)
+                            if file_type is None:
+                                raise ValueError("Only PDF and image files allowed")
+                        size += len(chunk)
+                        if size > settings.MAX_FILE_SIZE:
+                            raise ValueError(f"File exceeds {settings.MAX_FILE_SIZE} bytes")
+                        if size > budget:
+                            raise ValueError("Batch size limit reached")
+                        target.write(chunk)
+                if file_type is None:
+                    raise ValueError("File is empty")
+            except (ValueError, RuntimeError, NotImplementedError, zipfile.BadZipFile) as e:
+                # RuntimeError: encrypted entry, NotImplementedError: unsupported compression
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                rejected.append({"filename": name, "reason": str(e)})
+                continue
+            
+            budget -= size
+            accepted.append({"filename": name, "file_path": file_path, "size": size, "file_type": file_type})
+    
+    return accepted, rejected, budget
+
+def batch_progress(db: Session, batch_id: int) -> Dict[str, int]:
+    counts = db.query(Document.processing_status, func.count(Document.id)).filter(
+        Document.batch_id == batch_id
+    ).group_by(Document.processing_status).all()
+    return {processing_status: count for processing_status, count in counts}
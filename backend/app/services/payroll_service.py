@@ -0,0 +1,160 @@
+﻿import codecs
+import csv
+import io
+import json
+import math
+from typing import Dict, IO, Iterator, List
+from sqlalchemy import insert
+from app.db.models import TaxCalculation
+from app.db.session import SessionLocal
+from app.services.tax_engine import calculate_income_tax, calculate_advance_tax
+
+OUTPUT_COLUMNS = [
+    "employee_id", "total_income", "total_deductions", "taxable_income",
+    "annual_tax", "monthly_withholding", "error"
+]
+AMOUNT_COLUMNS = ["salary_income", "business_income", "other_income", "deductions"]
+
+def validate_payroll_upload(stream: IO[bytes], fmt: str):
+    # Decode and header errors would otherwise only surface mid-stream, after
+    # the 200 and headers have gone out, so check them before responding
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    offset = 0
+    while True:
+        block = stream.read(1024 * 1024)
+        try:
+            decoder.decode(block, final=not block)
+        except UnicodeDecodeError as e:
+            raise ValueError(f"Upload is not valid UTF-8 (byte {offset + e.start})")
+        if not block:
+            break
+        offset += len(block)
+    stream.seek(0)
+    
+    if fmt == "csv":
+        text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+        try:
+            header = next(csv.reader(text), None)
+        except csv.Error as e:
+            raise ValueError(f"Invalid CSV header ({e})")
+        finally:
+            text.detach()
+        if not header or not set(header) & {"employee_id", *AMOUNT_COLUMNS}:
+            raise ValueError(f"CSV header must name employee_id or one of {', '.join(AMOUNT_COLUMNS)}")
+        stream.seek(0)
+
+def iter_payroll_rows(stream: IO[bytes], fmt: str) -> Iterator[Dict]:
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "ndjson":
+        for line in text:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield {"_error": f"invalid JSON ({e.msg})"}
+    else:
+        reader = csv.DictReader(text)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield {"_error": f"invalid CSV ({e})"}
+                continue
+            yield row
+
+def compute_withholding(row: Dict, months_remaining: int) -> Dict:
+    if not isinstance(row, dict):
+        raise ValueError("expected one object per line")
+    if "_error" in row:
+        raise ValueError(row["_error"])
+    
+    amounts = {}
+    for column in AMOUNT_COLUMNS:
+        value = float(row.get(column) or 0)
+        if not math.isfinite(value) or value < 0:
+            raise ValueError(f"{column} must be a finite, non-negative amount")
+        amounts[column] = value
+    total_income = amounts["salary_income"] + amounts["business_income"] + amounts["other_income"]
+    total_deductions = round(amounts["deductions"], 2)
+    taxable_income = max(0, total_income - total_deductions)
+    tax_liability, _ = calculate_income_tax(taxable_income)
+    
+    return {
+        **amounts,
+        "total_income": total_income,
+        "total_deductions": total_deductions,
+        "taxable_income": taxable_income,
+        "tax_liability": tax_liability,
+        "monthly_withholding": calculate_advance_tax(tax_liability, months_remaining)
+    }
+
+def stream_withholding_csv(
+    stream: IO[bytes],
+    fmt: str,
+    user_id: int,
+    tax_year: int,
+    months_remaining: int,
+    chunk_size: int
+) -> Iterator[str]:
+    # Rows are read, computed, persisted and written back one chunk at a time,
+    # so memory stays flat no matter how many employees are in the upload
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(OUTPUT_COLUMNS)
+    
+    db = SessionLocal()
+    try:
+        chunk: List[Dict] = []
+        rows = iter_payroll_rows(stream, fmt)
+        while True:
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    break
+            if not chunk:
+                break
+            
+            history = []
+            for row in chunk:
+                employee_id = row.get("employee_id", "") if isinstance(row, dict) else ""
+                try:
+                    result = compute_withholding(row, months_remaining)
+                except (TypeError, ValueError) as e:
+                    writer.writerow([employee_id, "", "", "", "", "", f"Invalid row: {e}"])
+                    continue
+                
+                writer.writerow([
+                    employee_id, result["total_income"], result["total_deductions"],
+                    result["taxable_income"], result["tax_liability"], result["monthly_withholding"], ""
+                ])
+                history.append({
+                    "user_id": user_id,
+                    "tax_year": tax_year,
+                    "employee_id": str(employee_id) if employee_id not in (None, "") else None,
+                    "total_income": result["total_income"],
+                    "salary_income": result["salary_income"],
+                    "business_income": result["business_income"],
+                    "other_income": result["other_income"],
+                    "total_deductions": result["total_deductions"],
+                    "taxable_income": result["taxable_income"],
+                    "tax_liability": result["tax_liability"],
+                    "status": "payroll"
+                })
+            
+            if history:
+                db.execute(insert(TaxCalculation), history)
+                db.commit()
+            
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            chunk = []
+    finally:
+        db.close()
+        stream.close()
+    
+    if buffer.tell():
+        yield buffer.getvalue()
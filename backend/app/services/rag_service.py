@@ -1,13 +1,77 @@
 ﻿import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import pickle
 import os
+import re
+import math
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.core.security import redact_pii
+from app.core.metrics import stage_timer
+
+RAG_MODES = ("dense", "sparse", "hybrid")
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower().replace(",", ""))
+
+class BM25Index:
+    def __init__(self, documents: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_lengths = []
+        
+        for doc_id, text in enumerate(documents):
+            terms = Counter(tokenize(text))
+            self.doc_lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self.postings.setdefault(term, []).append((doc_id, tf))
+        
+        n_docs = len(self.doc_lengths)
+        self.avg_length = (sum(self.doc_lengths) / n_docs) if n_docs else 0.0
+        self.idf = {
+            term: math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+    
+    def search(self, query: str, k: int = 3) -> List[Tuple[int, float]]:
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / (self.avg_length or 1))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+def reciprocal_rank_fusion(rankings: List[List[Dict]], k: int, rrf_k: int = 60) -> List[Dict]:
+    fused = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = (doc['source'], doc['text'])
+            entry = fused.setdefault(key, dict(doc, score=0.0))
+            entry['score'] += 1.0 / (rrf_k + rank + 1)
+    
+    return sorted(fused.values(), key=lambda doc: doc['score'], reverse=True)[:k]
 
 class TaxKnowledgeBase:
-    def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+    def __init__(self, mode: Optional[str] = None):
+        self.mode = mode or settings.RAG_MODE
+        if self.mode not in RAG_MODES:
+            raise ValueError(f"RAG_MODE must be one of {RAG_MODES}, got {self.mode!r}")
+        
+        self.model = None
+        if self.mode != "sparse":
+            # Imported lazily so sparse-only nodes never load torch or the transformer
+            from sentence_transformers import SentenceTransformer
+            self.model = SentenceTransformer('all-MiniLM-L6-v2')
         self.index = None
+        self.sparse_index = None
         self.documents = []
         self.index_file = 'tax_knowledge.index'
         self.docs_file = 'tax_knowledge.pkl'
@@ -44,7 +108,13 @@ class TaxKnowledgeBase:
         self._build_index()
     
     def _build_index(self):
-        if os.path.exists(self.index_file) and os.path.exists(self.docs_file):
+        if self.model is None:
+            self.documents = self.tax_knowledge
+            if os.path.exists(self.docs_file):
+                with open(self.docs_file, 'rb') as f:
+                    self.documents = pickle.load(f)
+            print(" Built sparse-only RAG index")
+        elif os.path.exists(self.index_file) and os.path.exists(self.docs_file):
             self.index = faiss.read_index(self.index_file)
             with open(self.docs_file, 'rb') as f:
                 self.documents = pickle.load(f)
@@ -62,22 +132,248 @@ class TaxKnowledgeBase:
             with open(self.docs_file, 'wb') as f:
                 pickle.dump(self.documents, f)
             print(" Built new RAG index")
+        
+        self.sparse_index = BM25Index(self.documents)
+    
+    @property
+    def uses_dense(self) -> bool:
+        return self.mode != "sparse"
+    
+    @property
+    def uses_sparse(self) -> bool:
+        return self.mode != "dense"
+    
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        with stage_timer("rag_encode"):
+            embeddings = self.model.encode(texts, batch_size=batch_size)
+        return np.array(embeddings).astype('float32')
     
     def search(self, query: str, k: int = 3):
-        query_embedding = self.model.encode([query])
-        query_embedding = np.array(query_embedding).astype('float32')
+        depth = k * 2 if self.mode == "hybrid" else k
+        rankings = []
+        if self.uses_dense:
+            rankings.append(self.search_embedding(self.encode([query]), depth))
+        if self.uses_sparse:
+            rankings.append(self.search_sparse(query, depth))
         
-        distances, indices = self.index.search(query_embedding, k)
+        if len(rankings) == 1:
+            return rankings[0][:k]
+        return reciprocal_rank_fusion(rankings, k, settings.RAG_RRF_K)
+    
+    def search_embedding(self, query_embedding: np.ndarray, k: int = 3):
+        with stage_timer("rag_faiss_search"):
+            distances, indices = self.index.search(query_embedding, k)
         
         results = []
         for idx, distance in zip(indices[0], distances[0]):
-            if idx < len(self.documents):
+            if 0 <= idx < len(self.documents):
                 results.append({
                     'text': self.documents[idx],
-                    'score': float(distance)
+                    'score': float(distance),
+                    'source': 'FBR knowledge base'
                 })
         
         return results
+    
+    def search_sparse(self, query: str, k: int = 3):
+        with stage_timer("rag_bm25_search"):
+            hits = self.sparse_index.search(query, k)
+        return [
+            {'text': self.documents[idx], 'score': score, 'source': 'FBR knowledge base'}
+            for idx, score in hits
+        ]
+
+# One partition per user over chunks of their uploaded documents: a faiss
+# index for dense search plus the chunk texts, which back the BM25 side
+class UserDocumentStore:
+    def __init__(self, knowledge_base: TaxKnowledgeBase, store_dir: str, max_cached_users: int = 256):
+        self.kb = knowledge_base
+        self.store_dir = store_dir
+        self.max_cached_users = max_cached_users
+        self._partitions = OrderedDict()
+        # Guards only the LRU and the lock table; partitions have their own locks
+        self._lock = threading.Lock()
+        self._user_locks: Dict[int, Tuple[threading.Lock, threading.Lock]] = {}
+        os.makedirs(self.store_dir, exist_ok=True)
+    
+    def _paths(self, user_id: int):
+        base = os.path.join(self.store_dir, f"user_{user_id}")
+        return f"{base}.index", f"{base}.pkl"
+    
+    def _locks(self, user_id: int) -> Tuple[threading.Lock, threading.Lock]:
+        # (partition lock, file write lock) for one user
+        with self._lock:
+            locks = self._user_locks.get(user_id)
+            if locks is None:
+                locks = self._user_locks[user_id] = (threading.Lock(), threading.Lock())
+            return locks
+    
+    def _partition(self, user_id: int) -> Dict:
+        # Caller holds the user's partition lock
+        with self._lock:
+            if user_id in self._partitions:
+                self._partitions.move_to_end(user_id)
+                return self._partitions[user_id]
+        
+        index_file, chunks_file = self._paths(user_id)
+        partition = {"index": None, "chunks": {}, "next_id": 0, "sparse": None}
+        # Waits out a write still in flight for this user, so a partition
+        # evicted mid-write is never reloaded from stale files
+        with self._locks(user_id)[1]:
+            if os.path.exists(chunks_file):
+                with open(chunks_file, 'rb') as f:
+                    partition["chunks"], partition["next_id"] = pickle.load(f)
+                if self.kb.uses_dense and os.path.exists(index_file):
+                    partition["index"] = faiss.read_index(index_file)
+        
+        with self._lock:
+            self._partitions[user_id] = partition
+            if len(self._partitions) > self.max_cached_users:
+                self._partitions.popitem(last=False)
+        return partition
+    
+    def _snapshot(self, partition: Dict):
+        # Cheap in-memory copy taken under the partition lock; chunk entries
+        # are never mutated in place, so a shallow copy of the dict is enough
+        index_bytes = faiss.serialize_index(partition["index"]) if partition["index"] is not None else None
+        return index_bytes, dict(partition["chunks"]), partition["next_id"]
+    
+    def _write(self, user_id: int, snapshot, write_lock: threading.Lock):
+        # Runs after the partition lock is released, holding the user's write
+        # lock taken under it: searches go on while this user's files are written
+        try:
+            index_bytes, chunks, next_id = snapshot
+            index_file, chunks_file = self._paths(user_id)
+            if index_bytes is not None:
+                with open(f"{index_file}.tmp", 'wb') as f:
+                    f.write(index_bytes.tobytes())
+                os.replace(f"{index_file}.tmp", index_file)
+            with open(f"{chunks_file}.tmp", 'wb') as f:
+                pickle.dump((chunks, next_id), f)
+            os.replace(f"{chunks_file}.tmp", chunks_file)
+        finally:
+            write_lock.release()
+    
+    @staticmethod
+    def chunk_text(text: str, size: int, overlap: int) -> List[str]:
+        words = text.split()
+        step = max(1, size - overlap)
+        return [" ".join(words[i:i + size]) for i in range(0, max(len(words) - overlap, 1), step) if words[i:i + size]]
+    
+    def add_document(self, user_id: int, document_id: int, text: str):
+        chunks = self.chunk_text(redact_pii(text), settings.RAG_CHUNK_WORDS, settings.RAG_CHUNK_OVERLAP)
+        if not chunks:
+            return
+        
+        # Embedding is the slow part, keep it outside the lock
+        embeddings = None
+        if self.kb.uses_dense:
+            embeddings = self.kb.encode(chunks, batch_size=settings.RAG_EMBED_BATCH_SIZE)
+        
+        partition_lock, write_lock = self._locks(user_id)
+        with partition_lock:
+            partition = self._partition(user_id)
+            ids = np.arange(partition["next_id"], partition["next_id"] + len(chunks), dtype='int64')
+            
+            if embeddings is not None:
+                if partition["index"] is None:
+                    partition["index"] = faiss.IndexIDMap2(faiss.IndexFlatL2(embeddings.shape[1]))
+                partition["index"].add_with_ids(embeddings, ids)
+            
+            for chunk_id, chunk in zip(ids.tolist(), chunks):
+                partition["chunks"][chunk_id] = {"document_id": document_id, "text": chunk}
+            partition["next_id"] += len(chunks)
+            partition["sparse"] = None
+            snapshot = self._snapshot(partition)
+            # Taken before the partition is released so writes land in order
+            # and a reload after eviction waits for this one
+            write_lock.acquire()
+        self._write(user_id, snapshot, write_lock)
+    
+    def remove_document(self, user_id: int, document_id: int):
+        partition_lock, write_lock = self._locks(user_id)
+        with partition_lock:
+            partition = self._partition(user_id)
+            ids = [chunk_id for chunk_id, chunk in partition["chunks"].items() if chunk["document_id"] == document_id]
+            if not ids:
+                return
+            
+            if partition["index"] is not None:
+                partition["index"].remove_ids(np.array(ids, dtype='int64'))
+            for chunk_id in ids:
+                del partition["chunks"][chunk_id]
+            partition["sparse"] = None
+            snapshot = self._snapshot(partition)
+            write_lock.acquire()
+        self._write(user_id, snapshot, write_lock)
+    
+    def search_embedding(self, user_id: int, query_embedding: np.ndarray, k: int = 3):
+        with self._locks(user_id)[0]:
+            partition = self._partition(user_id)
+            if partition["index"] is None or partition["index"].ntotal == 0:
+                return []
+            with stage_timer("rag_user_faiss_search"):
+                distances, ids = partition["index"].search(query_embedding, k)
+            chunks = partition["chunks"]
+            
+            return [
+                {
+                    'text': chunks[chunk_id]["text"],
+                    'score': float(distance),
+                    'source': f"document {chunks[chunk_id]['document_id']}"
+                }
+                for chunk_id, distance in zip(ids[0].tolist(), distances[0])
+                if chunk_id in chunks
+            ]
+    
+    def search_sparse(self, user_id: int, query: str, k: int = 3):
+        with self._locks(user_id)[0]:
+            partition = self._partition(user_id)
+            if not partition["chunks"]:
+                return []
+            if partition["sparse"] is None:
+                chunk_ids = list(partition["chunks"])
+                texts = [partition["chunks"][chunk_id]["text"] for chunk_id in chunk_ids]
+                partition["sparse"] = (BM25Index(texts), chunk_ids)
+            sparse_index, chunk_ids = partition["sparse"]
+            chunks = partition["chunks"]
+            with stage_timer("rag_user_bm25_search"):
+                hits = sparse_index.search(query, k)
+            
+            return [
+                {
+                    'text': chunks[chunk_ids[idx]]["text"],
+                    'score': score,
+                    'source': f"document {chunks[chunk_ids[idx]]['document_id']}"
+                }
+                for idx, score in hits
+            ]
+
+def retrieve(question: str, user_id: Optional[int] = None, k: int = 3):
+    # Fused modes pull a deeper candidate list from each side before RRF
+    depth = k * 2 if tax_kb.mode == "hybrid" else k
+    rankings = []
+    
+    if tax_kb.uses_dense:
+        query_embedding = tax_kb.encode([question])
+        dense = tax_kb.search_embedding(query_embedding, depth)
+        if user_id is not None:
+            # Same encoder and metric on both sides, so L2 distances are directly comparable
+            dense += user_documents.search_embedding(user_id, query_embedding, depth)
+            dense.sort(key=lambda doc: doc['score'])
+        rankings.append(dense[:depth])
+    
+    if tax_kb.uses_sparse:
+        rankings.append(tax_kb.search_sparse(question, depth))
+        if user_id is not None:
+            # BM25 scores depend on each corpus's own statistics, so the FBR
+            # index and the user's partition are fused by rank, not by score
+            rankings.append(user_documents.search_sparse(user_id, question, depth))
+    
+    if len(rankings) == 1:
+        return rankings[0][:k]
+    return reciprocal_rank_fusion(rankings, k, settings.RAG_RRF_K)
 
-# Global instance
+# Global instances
 tax_kb = TaxKnowledgeBase()
+user_documents = UserDocumentStore(tax_kb, settings.VECTOR_STORE_DIR)
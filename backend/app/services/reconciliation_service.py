@@ -0,0 +1,144 @@
+﻿import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.db.models import TaxCalculation, WealthStatement
+
+def _year_pairs_query(user_id: Optional[int]):
+    # Latest own (non-payroll) calculation per user and tax year
+    calc_filter = [TaxCalculation.status != "payroll"]
+    wealth_filter = []
+    if user_id is not None:
+        calc_filter.append(TaxCalculation.user_id == user_id)
+        wealth_filter.append(WealthStatement.user_id == user_id)
+    
+    calcs = select(
+        TaxCalculation.user_id,
+        TaxCalculation.tax_year,
+        TaxCalculation.total_income,
+        TaxCalculation.tax_liability,
+        func.row_number().over(
+            partition_by=(TaxCalculation.user_id, TaxCalculation.tax_year),
+            order_by=(TaxCalculation.calculation_date.desc(), TaxCalculation.id.desc())
+        ).label("rn")
+    ).where(*calc_filter).subquery("calcs")
+    
+    # Each statement next to the previous year's net wealth
+    wealth = select(
+        WealthStatement.user_id,
+        WealthStatement.tax_year,
+        WealthStatement.net_wealth,
+        func.lag(WealthStatement.tax_year).over(
+            partition_by=WealthStatement.user_id, order_by=WealthStatement.tax_year
+        ).label("prev_year"),
+        func.lag(WealthStatement.net_wealth).over(
+            partition_by=WealthStatement.user_id, order_by=WealthStatement.tax_year
+        ).label("prev_net_wealth")
+    ).where(*wealth_filter).subquery("wealth")
+    
+    return select(
+        wealth.c.user_id,
+        wealth.c.prev_year,
+        wealth.c.tax_year,
+        wealth.c.prev_net_wealth,
+        wealth.c.net_wealth,
+        calcs.c.total_income,
+        calcs.c.tax_liability
+    ).select_from(
+        wealth.outerjoin(calcs, and_(
+            calcs.c.user_id == wealth.c.user_id,
+            calcs.c.tax_year == wealth.c.tax_year,
+            calcs.c.rn == 1
+        ))
+    ).where(
+        wealth.c.prev_year == wealth.c.tax_year - 1
+    ).order_by(wealth.c.user_id, wealth.c.tax_year)
+
+def compute_gaps(rows: List) -> List[Dict]:
+    if not rows:
+        return []
+    
+    columns = np.array([
+        [row.prev_net_wealth, row.net_wealth, row.total_income, row.tax_liability]
+        for row in rows
+    ], dtype=float)
+    prev_net, net, income, tax = columns.T
+    has_income = ~np.isnan(income)
+    income = np.nan_to_num(income)
+    tax = np.nan_to_num(tax)
+    prev_net = np.nan_to_num(prev_net)
+    net = np.nan_to_num(net)
+    
+    wealth_increase = net - prev_net
+    # Tax paid is the only outflow we know about; everything else counts as savings
+    explained = income - tax
+    gap = wealth_increase - explained
+    tolerance = np.maximum(settings.RECONCILIATION_TOLERANCE, np.abs(explained) * settings.RECONCILIATION_TOLERANCE_RATE)
+    flagged = (gap > tolerance) | (~has_income & (wealth_increase > settings.RECONCILIATION_TOLERANCE))
+    
+    return [
+        {
+            "user_id": row.user_id,
+            "from_year": row.prev_year,
+            "to_year": row.tax_year,
+            "wealth_increase": round(float(wealth_increase[i]), 2),
+            "declared_income": round(float(income[i]), 2) if has_income[i] else None,
+            "tax_liability": round(float(tax[i]), 2),
+            "explained_increase": round(float(explained[i]), 2),
+            "unexplained_gap": round(float(gap[i]), 2),
+            "flagged": bool(flagged[i])
+        }
+        for i, row in enumerate(rows)
+    ]
+
+def _fingerprint(db: Session, user_id: Optional[int]) -> Tuple:
+    # Cheap change detector: statements bump updated_at on every edit and
+    # calculations are insert-only, so counts + maxima catch any change
+    wealth = select(
+        func.count(WealthStatement.id), func.max(WealthStatement.updated_at)
+    )
+    calcs = select(
+        func.count(TaxCalculation.id), func.max(TaxCalculation.id)
+    ).where(TaxCalculation.status != "payroll")
+    if user_id is not None:
+        wealth = wealth.where(WealthStatement.user_id == user_id)
+        calcs = calcs.where(TaxCalculation.user_id == user_id)
+    return tuple(db.execute(wealth).one()) + tuple(db.execute(calcs).one())
+
+class ReconciliationCache:
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, fingerprint: Tuple) -> Optional[List[Dict]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == fingerprint:
+                self._entries.move_to_end(key)
+                return entry[1]
+            return None
+    
+    def put(self, key, fingerprint: Tuple, result: List[Dict]):
+        with self._lock:
+            self._entries[key] = (fingerprint, result)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+reconciliation_cache = ReconciliationCache()
+
+def reconcile(db: Session, user_id: Optional[int] = None) -> List[Dict]:
+    # user_id=None reconciles every user (admin batch job)
+    key = user_id if user_id is not None else "all"
+    fingerprint = _fingerprint(db, user_id)
+    cached = reconciliation_cache.get(key, fingerprint)
+    if cached is not None:
+        return cached
+    
+    result = compute_gaps(db.execute(_year_pairs_query(user_id)).all())
+    reconciliation_cache.put(key, fingerprint, result)
+    return result
@@ -0,0 +1,102 @@
+﻿from typing import Dict, List, Tuple
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+# Postgres keeps a generated tsvector column behind a GIN index; SQLite (local
+# testing) gets an FTS5 virtual table keyed by rowid = document id
+POSTGRES_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS document_search (
+        document_id INTEGER PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        body TEXT NOT NULL,
+        search_vector TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', body)) STORED
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_document_search_vector ON document_search USING GIN (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_document_search_user_id ON document_search (user_id)",
+]
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS document_search USING fts5(body, user_id UNINDEXED)",
+]
+
+def _is_postgres(db) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+def create_search_index(engine: Engine):
+    statements = POSTGRES_DDL if engine.dialect.name == "postgresql" else SQLITE_DDL
+    with engine.begin() as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+
+def index_document(db: Session, document_id: int, user_id: int, body: str):
+    if _is_postgres(db):
+        db.execute(text("""
+            INSERT INTO document_search (document_id, user_id, body)
+            VALUES (:document_id, :user_id, :body)
+            ON CONFLICT (document_id) DO UPDATE SET user_id = EXCLUDED.user_id, body = EXCLUDED.body
+        """), {"document_id": document_id, "user_id": user_id, "body": body})
+    else:
+        remove_document(db, document_id)
+        db.execute(text(
+            "INSERT INTO document_search (rowid, body, user_id) VALUES (:document_id, :body, :user_id)"
+        ), {"document_id": document_id, "user_id": user_id, "body": body})
+
+def remove_document(db: Session, document_id: int):
+    if _is_postgres(db):
+        db.execute(text("DELETE FROM document_search WHERE document_id = :document_id"), {"document_id": document_id})
+    else:
+        db.execute(text("DELETE FROM document_search WHERE rowid = :document_id"), {"document_id": document_id})
+
+def _fts5_query(query: str) -> str:
+    # Quote every term so user input can't inject FTS5 operators or syntax errors
+    terms = [term.replace('"', '""') for term in query.split()]
+    return " ".join(f'"{term}"' for term in terms if term)
+
+def search_documents(db: Session, user_id: int, query: str, limit: int = 10, offset: int = 0) -> Tuple[int, List[Dict]]:
+    params = {"user_id": user_id, "limit": limit, "offset": offset}
+    
+    if _is_postgres(db):
+        params["query"] = query
+        total = db.execute(text("""
+            SELECT count(*) FROM document_search, websearch_to_tsquery('english', :query) AS q
+            WHERE user_id = :user_id AND search_vector @@ q
+        """), params).scalar()
+        # Rank and paginate first so ts_headline only runs on the returned page
+        rows = db.execute(text("""
+            SELECT hits.document_id, d.original_filename, hits.rank,
+                   ts_headline('english', s.body, hits.q,
+                               'StartSel=<b>, StopSel=</b>, MaxFragments=2, MaxWords=24, MinWords=8') AS snippet
+            FROM (
+                SELECT document_id, q, ts_rank(search_vector, q) AS rank
+                FROM document_search, websearch_to_tsquery('english', :query) AS q
+                WHERE user_id = :user_id AND search_vector @@ q
+                ORDER BY rank DESC, document_id DESC
+                LIMIT :limit OFFSET :offset
+            ) AS hits
+            JOIN document_search s ON s.document_id = hits.document_id
+            JOIN documents d ON d.id = hits.document_id
+            ORDER BY hits.rank DESC, hits.document_id DESC
+        """), params).mappings().all()
+    else:
+        params["query"] = _fts5_query(query)
+        if not params["query"]:
+            return 0, []
+        total = db.execute(text("""
+            SELECT count(*) FROM document_search
+            WHERE document_search MATCH :query AND user_id = :user_id
+        """), params).scalar()
+        rows = db.execute(text("""
+            SELECT document_search.rowid AS document_id, d.original_filename,
+                   -bm25(document_search) AS rank,
+                   snippet(document_search, 0, '<b>', '</b>', '...', 24) AS snippet
+            FROM document_search
+            JOIN documents d ON d.id = document_search.rowid
+            WHERE document_search MATCH :query AND document_search.user_id = :user_id
+            ORDER BY rank DESC, document_id DESC
+            LIMIT :limit OFFSET :offset
+        """), params).mappings().all()
+    
+    return total, [dict(row) for row in rows]
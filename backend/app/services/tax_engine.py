@@ -1,5 +1,13 @@
 ﻿from typing import List, Dict, Tuple
-from app.core.config import TAX_SLABS
+import numpy as np
+from app.core.config import TAX_SLABS, DEDUCTION_CAPS
+
+# Slab table as arrays for the vectorized scenario paths
+SLAB_MINS = np.array([slab["min"] for slab in TAX_SLABS["slabs"]], dtype=float)
+SLAB_RATES = np.array([slab["rate"] for slab in TAX_SLABS["slabs"]], dtype=float)
+SLAB_FIXED = np.array([slab["fixed"] for slab in TAX_SLABS["slabs"]], dtype=float)
+# Top of the 0% slab: deductions below this line save no tax
+TAX_FREE_INCOME = float(max(slab["max"] for slab in TAX_SLABS["slabs"] if slab["rate"] == 0))
 
 def calculate_income_tax(taxable_income: float) -> Tuple[float, List[Dict]]:
     slabs = TAX_SLABS["slabs"]
@@ -43,6 +51,13 @@ def calculate_income_tax(taxable_income: float) -> Tuple[float, List[Dict]]:
 def apply_deductions(deductions_amount: float) -> float:
     return round(deductions_amount, 2)
 
+def apply_capped_deductions(income: float, life_insurance: float = 0, charity: float = 0, pension: float = 0) -> float:
+    life_insurance = min(life_insurance, DEDUCTION_CAPS["life_insurance"])
+    pension = min(pension, income * DEDUCTION_CAPS["pension_rate"])
+    # Charity is capped on taxable income, i.e. net of the other deductions
+    charity = min(charity, max(income - life_insurance - pension, 0) * DEDUCTION_CAPS["charity_rate"])
+    return apply_deductions(life_insurance + charity + pension)
+
 def calculate_tax_for_salaried_individual(
     annual_salary: float,
     other_income: float = 0,
@@ -84,3 +99,71 @@ def get_tax_saving_suggestions(income: float, current_deductions: float) -> List
 
 def calculate_advance_tax(tax_liability: float, months_remaining: int = 12) -> float:
     return round(tax_liability / months_remaining, 2)
+
+def calculate_income_tax_vectorized(taxable_incomes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Same slab selection as calculate_income_tax: the last slab whose lower
+    # bound the income exceeds. Returns (tax, marginal rate) arrays.
+    incomes = np.maximum(np.asarray(taxable_incomes, dtype=float), 0)
+    idx = np.clip(np.searchsorted(SLAB_MINS, incomes, side="left") - 1, 0, None)
+    tax = SLAB_FIXED[idx] + (incomes - SLAB_MINS[idx]) * SLAB_RATES[idx]
+    return np.round(tax, 2), SLAB_RATES[idx]
+
+def capped_deductions(incomes: np.ndarray, life_insurance, charity, pension) -> Dict[str, np.ndarray]:
+    # Vectorized apply_capped_deductions; the amounts broadcast against incomes
+    incomes = np.asarray(incomes, dtype=float)
+    life_insurance = np.minimum(life_insurance, DEDUCTION_CAPS["life_insurance"])
+    pension = np.minimum(pension, incomes * DEDUCTION_CAPS["pension_rate"])
+    charity_cap = np.maximum(incomes - life_insurance - pension, 0) * DEDUCTION_CAPS["charity_rate"]
+    return {
+        "life_insurance": life_insurance,
+        "charity": np.minimum(charity, charity_cap),
+        "pension": pension
+    }
+
+def sweep_scenarios(incomes: np.ndarray, mixes: np.ndarray) -> Dict[str, np.ndarray]:
+    # incomes: (n,), mixes: (m, 3) of [life_insurance, charity, pension].
+    # Every (mix, income) point is evaluated in one broadcast pass -> (m, n) arrays.
+    incomes = np.asarray(incomes, dtype=float)
+    mixes = np.asarray(mixes, dtype=float).reshape(-1, 3)
+    capped = capped_deductions(incomes, mixes[:, [0]], mixes[:, [1]], mixes[:, [2]])
+    allowed = np.round(capped["life_insurance"] + capped["charity"] + capped["pension"], 2)
+    taxable = np.maximum(incomes - allowed, 0)
+    tax, marginal = calculate_income_tax_vectorized(taxable)
+    effective = np.divide(tax, incomes, out=np.zeros_like(tax), where=incomes > 0)
+    
+    return {
+        "allowed_deductions": allowed,
+        "taxable_income": taxable,
+        "tax": tax,
+        "effective_rate": effective,
+        "marginal_rate": marginal
+    }
+
+def optimize_deductions(incomes: np.ndarray, budget: float) -> Dict[str, np.ndarray]:
+    # Each capped deduction lowers taxable income rupee for rupee, so the tax
+    # saving only depends on how much of the budget fits under the caps. Fill
+    # pension first (it stays the taxpayer's money), then insurance, then
+    # charity, whose cap shrinks as the other two grow. Nothing is allocated
+    # past the point where taxable income reaches the 0% slab.
+    incomes = np.asarray(incomes, dtype=float)
+    budget = max(budget, 0)
+    remaining = np.minimum(budget, np.maximum(incomes - TAX_FREE_INCOME, 0))
+    
+    allocation = {}
+    allocation["pension"] = np.minimum(remaining, incomes * DEDUCTION_CAPS["pension_rate"])
+    remaining = remaining - allocation["pension"]
+    allocation["life_insurance"] = np.minimum(remaining, DEDUCTION_CAPS["life_insurance"])
+    remaining = remaining - allocation["life_insurance"]
+    charity_cap = np.maximum(incomes - allocation["pension"] - allocation["life_insurance"], 0) * DEDUCTION_CAPS["charity_rate"]
+    allocation["charity"] = np.minimum(remaining, charity_cap)
+    
+    baseline, _ = calculate_income_tax_vectorized(incomes)
+    total = allocation["pension"] + allocation["life_insurance"] + allocation["charity"]
+    tax, _ = calculate_income_tax_vectorized(incomes - total)
+    
+    return {
+        **allocation,
+        "unused_budget": budget - total,
+        "tax": tax,
+        "tax_saving": baseline - tax
+    }
@@ -0,0 +1,265 @@
+﻿import csv
+import hashlib
+import io
+import json
+from datetime import datetime
+from typing import Dict, IO, Iterator, List, Optional, Tuple
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+from app.db.models import WealthStatement, WealthLineItem
+from app.db.session import dialect_insert
+
+# WealthInput list field -> (category, kind, amount key inside each entry)
+LIST_CATEGORIES = {
+    "properties": ("property", "asset", "value"),
+    "vehicles": ("vehicle", "asset", "value"),
+    "bank_accounts": ("bank_account", "asset", "balance"),
+    "investments": ("investment", "asset", "value"),
+    "other_assets": ("other_asset", "asset", "value"),
+    "loans": ("loan", "liability", "amount"),
+    "other_liabilities": ("other_liability", "liability", "amount"),
+}
+# WealthInput scalar field -> (category, kind)
+SCALAR_CATEGORIES = {
+    "gold_silver": ("gold_silver", "asset"),
+    "cash_in_hand": ("cash_in_hand", "asset"),
+    "credit_cards": ("credit_card", "liability"),
+}
+
+CATEGORY_KINDS = {category: kind for category, kind, _ in LIST_CATEGORIES.values()}
+CATEGORY_KINDS.update({category: kind for category, kind in SCALAR_CATEGORIES.values()})
+# Imports may use either the singular category or the WealthInput field name
+CATEGORY_ALIASES = {field: category for field, (category, _, _) in LIST_CATEGORIES.items()}
+CATEGORY_ALIASES.update({field: category for field, (category, _) in SCALAR_CATEGORIES.items()})
+
+CATEGORY_LABELS = {
+    "property": "Property",
+    "vehicle": "Vehicle",
+    "bank_account": "Bank account",
+    "investment": "Investment",
+    "other_asset": "Other asset",
+    "gold_silver": "Gold & silver",
+    "cash_in_hand": "Cash in hand",
+    "loan": "Loan",
+    "credit_card": "Credit cards",
+    "other_liability": "Other liability",
+}
+
+def describe(entry: Dict) -> Optional[str]:
+    return entry.get("description") or entry.get("name") or entry.get("bank")
+
+def line_items_from_input(wealth_data: Dict) -> List[Dict]:
+    items = []
+    for field, (category, kind, amount_key) in LIST_CATEGORIES.items():
+        for position, entry in enumerate(wealth_data.get(field) or []):
+            items.append({
+                "category": category,
+                "kind": kind,
+                "external_ref": str(entry.get("ref") or f"{field}-{position}"),
+                "description": describe(entry),
+                "amount": float(entry.get(amount_key) or 0),
+                "details": entry
+            })
+    for field, (category, kind) in SCALAR_CATEGORIES.items():
+        if wealth_data.get(field):
+            items.append({
+                "category": category,
+                "kind": kind,
+                "external_ref": field,
+                "description": None,
+                "amount": float(wealth_data[field]),
+                "details": {}
+            })
+    return items
+
+def get_or_create_statement(db: Session, user_id: int, tax_year: int) -> WealthStatement:
+    statement = db.query(WealthStatement).filter(
+        WealthStatement.user_id == user_id,
+        WealthStatement.tax_year == tax_year
+    ).first()
+    if not statement:
+        statement = WealthStatement(user_id=user_id, tax_year=tax_year)
+        db.add(statement)
+        db.flush()
+    return statement
+
+def upsert_line_items(db: Session, statement: WealthStatement, items: List[Dict], batch_size: int = 1000):
+    if not items:
+        return
+    
+    insert = dialect_insert(WealthLineItem)
+    statement_sql = insert.on_conflict_do_update(
+        index_elements=["statement_id", "category", "external_ref"],
+        set_={
+            "kind": insert.excluded.kind,
+            "description": insert.excluded.description,
+            "amount": insert.excluded.amount,
+            "details": insert.excluded.details,
+        }
+    )
+    # A single INSERT ... ON CONFLICT may not touch the same key twice: last row wins
+    rows = list({
+        (item["category"], item["external_ref"]): {
+            **item, "statement_id": statement.id, "user_id": statement.user_id, "tax_year": statement.tax_year
+        }
+        for item in items
+    }.values())
+    for start in range(0, len(rows), batch_size):
+        db.execute(statement_sql, rows[start:start + batch_size])
+
+def replace_line_items(db: Session, statement: WealthStatement, items: List[Dict]):
+    db.query(WealthLineItem).filter(WealthLineItem.statement_id == statement.id).delete(synchronize_session=False)
+    upsert_line_items(db, statement, items)
+
+def refresh_totals(db: Session, statement: WealthStatement) -> WealthStatement:
+    total_assets, total_liabilities = db.query(
+        func.coalesce(func.sum(case((WealthLineItem.kind == "asset", WealthLineItem.amount), else_=0)), 0),
+        func.coalesce(func.sum(case((WealthLineItem.kind == "liability", WealthLineItem.amount), else_=0)), 0)
+    ).filter(WealthLineItem.statement_id == statement.id).one()
+    
+    statement.total_assets = float(total_assets)
+    statement.total_liabilities = float(total_liabilities)
+    statement.net_wealth = statement.total_assets - statement.total_liabilities
+    statement.updated_at = datetime.utcnow()
+    return statement
+
+def statement_payload(db: Session, statement: WealthStatement) -> Dict:
+    # Same shape WealthInput accepts, rebuilt from the line items
+    payload = {
+        "id": statement.id,
+        "tax_year": statement.tax_year,
+        **{field: [] for field in LIST_CATEGORIES},
+        **{field: 0.0 for field in SCALAR_CATEGORIES},
+        "total_assets": statement.total_assets,
+        "total_liabilities": statement.total_liabilities,
+        "net_wealth": statement.net_wealth,
+        "created_at": statement.created_at,
+        "updated_at": statement.updated_at
+    }
+    fields_by_category = {category: field for field, category in CATEGORY_ALIASES.items()}
+    
+    items = db.query(WealthLineItem).filter(
+        WealthLineItem.statement_id == statement.id
+    ).order_by(WealthLineItem.id).all()
+    for item in items:
+        field = fields_by_category[item.category]
+        if field in SCALAR_CATEGORIES:
+            payload[field] += item.amount
+        else:
+            entry = {**(item.details or {}), "ref": item.external_ref, LIST_CATEGORIES[field][2]: item.amount}
+            if item.description:
+                entry.setdefault("description", item.description)
+            payload[field].append(entry)
+    return payload
+
+def content_ref(category: str, description: Optional[str], amount: float, details: Dict) -> str:
+    # Rows without a ref are keyed by their content, so re-importing the same
+    # file updates them in place instead of colliding on row position
+    content = json.dumps([category, description, amount, details], sort_keys=True, default=str)
+    return "row-" + hashlib.sha256(content.encode()).hexdigest()[:16]
+
+def parse_import_row(row: Dict) -> Dict:
+    if "_error" in row:
+        raise ValueError(row["_error"])
+    category = str(row.get("category") or "").strip().lower()
+    category = CATEGORY_ALIASES.get(category, category)
+    if category not in CATEGORY_KINDS:
+        raise ValueError(f"unknown category {row.get('category')!r}")
+    
+    details = {key: value for key, value in row.items()
+               if key not in ("category", "amount", "ref", "description") and value not in (None, "")}
+    description = row.get("description") or None
+    amount = float(row.get("amount") or 0)
+    return {
+        "category": category,
+        "kind": CATEGORY_KINDS[category],
+        "external_ref": str(row.get("ref") or content_ref(category, description, amount, details)),
+        "description": description,
+        "amount": amount,
+        "details": details
+    }
+
+def iter_import_rows(stream: IO[bytes], fmt: str) -> Iterator[Dict]:
+    if fmt == "json":
+        rows = json.load(stream)
+        if not isinstance(rows, list):
+            raise ValueError("JSON import must be a list of line items")
+        yield from rows
+        return
+    
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "ndjson":
+        for line in text:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield {"_error": f"invalid JSON ({e.msg})"}
+    else:
+        reader = csv.DictReader(text)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield {"_error": f"invalid CSV ({e})"}
+                continue
+            yield row
+
+def import_line_items(db: Session, statement: WealthStatement, rows: Iterator[Dict], batch_size: int) -> Tuple[int, List[str]]:
+    imported = 0
+    errors = []
+    batch = []
+    
+    for position, row in enumerate(rows, start=1):
+        try:
+            if not isinstance(row, dict):
+                raise ValueError("expected an object")
+            batch.append(parse_import_row(row))
+        except (TypeError, ValueError) as e:
+            if len(errors) < 100:
+                errors.append(f"row {position}: {e}")
+            continue
+        
+        if len(batch) >= batch_size:
+            upsert_line_items(db, statement, batch, batch_size)
+            imported += len(batch)
+            batch = []
+    
+    upsert_line_items(db, statement, batch, batch_size)
+    imported += len(batch)
+    return imported, errors
+
+def wealth_delta(db: Session, user_id: int, from_year: int, to_year: int) -> Dict:
+    signed = case((WealthLineItem.kind == "asset", WealthLineItem.amount), else_=-WealthLineItem.amount)
+    rows = db.query(
+        WealthLineItem.category,
+        func.sum(case((WealthLineItem.tax_year == from_year, signed), else_=0)).label("from_amount"),
+        func.sum(case((WealthLineItem.tax_year == to_year, signed), else_=0)).label("to_amount")
+    ).filter(
+        WealthLineItem.user_id == user_id,
+        WealthLineItem.tax_year.in_([from_year, to_year])
+    ).group_by(WealthLineItem.category).all()
+    
+    categories = [
+        {
+            "category": row.category,
+            "from_amount": float(row.from_amount or 0),
+            "to_amount": float(row.to_amount or 0),
+            "delta": float((row.to_amount or 0) - (row.from_amount or 0))
+        }
+        for row in rows
+    ]
+    from_net = sum(item["from_amount"] for item in categories)
+    to_net = sum(item["to_amount"] for item in categories)
+    
+    return {
+        "from_year": from_year,
+        "to_year": to_year,
+        "from_net_wealth": from_net,
+        "to_net_wealth": to_net,
+        "net_wealth_delta": to_net - from_net,
+        "categories": categories
+    }
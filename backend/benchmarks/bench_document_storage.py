@@ -0,0 +1,86 @@
+﻿"""
+Document text storage benchmark
+Compares the legacy inline `raw_text[:5000]` row against compressed blob storage.
+Run from backend/: python benchmarks/bench_document_storage.py
+"""
+import os
+import random
+import tempfile
+import time
+from fixtures import statement_pages
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db.base import Base
+from app.db.models import User, Document, ExtractedData
+from app.services.document_store import save_document_text, load_document_page
+from app.services.ocr_service import extract_financial_data
+
+DOCUMENTS = 200
+PAGES_PER_DOCUMENT = 12
+LIST_ROUNDS = 50
+
+def populate(db_path: str, blob_storage: bool):
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    
+    user = User(email="bench@example.com", hashed_password="x", full_name="Bench")
+    db.add(user)
+    db.commit()
+    
+    for i in range(DOCUMENTS):
+        pages = statement_pages(random.Random(i), PAGES_PER_DOCUMENT)
+        text = "\n".join(pages)
+        document = Document(user_id=user.id, document_type="bank_statement", file_path=f"{i}.pdf",
+                            original_filename=f"{i}.pdf", processing_status="completed")
+        db.add(document)
+        db.flush()
+        
+        if blob_storage:
+            save_document_text(db, document.id, pages)
+            for field_name, field_value in extract_financial_data(text).items():
+                if field_value is not None:
+                    db.add(ExtractedData(document_id=document.id, field_name=field_name, field_value=str(field_value)))
+        else:
+            db.add(ExtractedData(document_id=document.id, field_name="raw_text", field_value=text[:5000]))
+    
+    db.commit()
+    return engine, db, user.id
+
+def time_list_queries(db, user_id: int) -> float:
+    start = time.perf_counter()
+    for _ in range(LIST_ROUNDS):
+        db.query(Document).filter(Document.user_id == user_id).all()
+        db.query(ExtractedData).join(Document).filter(Document.user_id == user_id).all()
+        db.expire_all()
+    return (time.perf_counter() - start) / LIST_ROUNDS * 1000
+
+def run(blob_storage: bool):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        engine, db, user_id = populate(db_path, blob_storage)
+        list_ms = time_list_queries(db, user_id)
+        
+        page_ms = None
+        if blob_storage:
+            start = time.perf_counter()
+            for document_id in range(1, DOCUMENTS + 1):
+                load_document_page(db, document_id, PAGES_PER_DOCUMENT // 2)
+            page_ms = (time.perf_counter() - start) / DOCUMENTS * 1000
+        
+        db.close()
+        engine.dispose()
+        return os.path.getsize(db_path) / DOCUMENTS / 1024, list_ms, page_ms
+
+if __name__ == "__main__":
+    full_chars = len("\n".join(statement_pages(random.Random(0), PAGES_PER_DOCUMENT)))
+    print(f" {DOCUMENTS} documents, ~{full_chars:,} characters of text each")
+    for label, blob_storage in (("inline raw_text[:5000]", False), ("compressed blob", True)):
+        kb_per_doc, list_ms, page_ms = run(blob_storage)
+        line = f" {label:<24} {kb_per_doc:8.1f} KB/doc  list+data query {list_ms:8.2f} ms"
+        if page_ms is not None:
+            line += f"  page range read {page_ms:.3f} ms"
+        print(line)
@@ -0,0 +1,114 @@
+﻿"""
+OCR pipeline benchmark
+Renders synthetic bank statement pages, degrades them like phone photos
+(upscaled, rotated via EXIF, uneven lighting, noise) and measures seconds per
+page and character accuracy (difflib ratio against the rendered text) for raw
+Tesseract versus the preprocessing pipeline in ocr_service.
+Needs the tesseract binary; without it only preprocessing time is reported.
+Run from backend/: python benchmarks/bench_ocr.py [--pages 10]
+"""
+import argparse
+import difflib
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from fixtures import statement_lines
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import numpy as np
+import pytesseract
+from PIL import Image, ImageDraw, ImageFont
+from app.core.config import settings
+from app.services.ocr_service import preprocess_image
+
+PAGE_SIZE = (2480, 3508)  # A4 at 300 DPI
+PHOTO_SCALE = 1.6
+
+def render_page(lines):
+    page = Image.new("L", PAGE_SIZE, 255)
+    draw = ImageDraw.Draw(page)
+    font = ImageFont.load_default(size=42)
+    for row, line in enumerate(lines):
+        draw.text((160, 200 + row * 80), line, fill=0, font=font)
+    return page
+
+def as_phone_photo(page: Image.Image, rng: random.Random, path: str):
+    photo = page.resize((int(page.width * PHOTO_SCALE), int(page.height * PHOTO_SCALE)), Image.BICUBIC)
+    pixels = np.asarray(photo, dtype=float)
+    # Uneven lighting across the page plus sensor noise
+    gradient = np.linspace(0.75, 1.0, pixels.shape[1])[None, :]
+    pixels = pixels * gradient + np.random.default_rng(rng.randint(0, 1 << 30)).normal(0, 12, pixels.shape)
+    photo = Image.fromarray(np.clip(pixels, 0, 255).astype("uint8")).convert("RGB")
+    # Stored sideways with an EXIF orientation tag, like most phone cameras
+    photo = photo.transpose(Image.ROTATE_90)
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    photo.save(path, "JPEG", quality=85, exif=exif.tobytes())
+
+def accuracy(expected: str, actual: str) -> float:
+    normalize = lambda text: " ".join(text.split())
+    return difflib.SequenceMatcher(None, normalize(expected), normalize(actual)).ratio()
+
+def run(pages: int):
+    rng = random.Random(42)
+    has_tesseract = shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
+    results = {"raw": {"seconds": [], "accuracy": []}, "pipeline": {"seconds": [], "accuracy": []}}
+    preprocess_seconds = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for page_no in range(pages):
+            lines = statement_lines(rng, rows=30)
+            expected = "\n".join(lines)
+            path = os.path.join(tmp, f"page_{page_no}.jpg")
+            as_phone_photo(render_page(lines), rng, path)
+
+            start = time.perf_counter()
+            with Image.open(path) as image:
+                prepared = preprocess_image(image)
+            preprocess_seconds.append(time.perf_counter() - start)
+
+            if not has_tesseract:
+                continue
+
+            start = time.perf_counter()
+            with Image.open(path) as image:
+                text = pytesseract.image_to_string(image)
+            results["raw"]["seconds"].append(time.perf_counter() - start)
+            results["raw"]["accuracy"].append(accuracy(expected, text))
+
+            start = time.perf_counter()
+            with Image.open(path) as image:
+                prepared = preprocess_image(image)
+            text = pytesseract.image_to_string(prepared, lang=settings.OCR_LANG, config=settings.OCR_TESSERACT_CONFIG)
+            results["pipeline"]["seconds"].append(time.perf_counter() - start)
+            results["pipeline"]["accuracy"].append(accuracy(expected, text))
+
+    summary = {
+        "pages": pages,
+        "tesseract": has_tesseract,
+        "preprocess_s_per_page": round(sum(preprocess_seconds) / pages, 4),
+        "preprocessed_size": list(prepared.size)
+    }
+    print(f" {pages} synthetic statement pages, {int(PAGE_SIZE[0] * PHOTO_SCALE)}px wide photos")
+    print(f" preprocessing {summary['preprocess_s_per_page']:.3f} s/page -> {prepared.size[0]}x{prepared.size[1]}")
+    if not has_tesseract:
+        print(" tesseract binary not found: OCR timings and accuracy skipped")
+    for mode, values in results.items():
+        if not values["seconds"]:
+            continue
+        summary[mode] = {
+            "s_per_page": round(sum(values["seconds"]) / pages, 3),
+            "char_accuracy": round(sum(values["accuracy"]) / pages, 4)
+        }
+        print(f" {mode:<9} {summary[mode]['s_per_page']:7.3f} s/page  char accuracy {summary[mode]['char_accuracy']:.3f}")
+    print(json.dumps(summary))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=10)
+    args = parser.parse_args()
+    run(args.pages)
@@ -0,0 +1,90 @@
+﻿"""
+RAG retrieval mode benchmark
+Measures build time, query latency, peak memory and retrieval quality of the
+dense, sparse and hybrid modes on the labelled questions in data/rag_questions.json.
+Each mode runs in its own process so peak RSS reflects only what that mode loads.
+Run from backend/: python benchmarks/bench_rag_modes.py [--modes sparse hybrid]
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from fixtures import BACKEND_DIR
+
+QUESTIONS_FILE = os.path.join(BACKEND_DIR, "benchmarks", "data", "rag_questions.json")
+K = 3
+ROUNDS = 5
+
+def measure_mode():
+    with open(QUESTIONS_FILE, encoding="utf-8") as f:
+        questions = json.load(f)
+    
+    start = time.perf_counter()
+    from app.services.rag_service import tax_kb
+    build_s = time.perf_counter() - start
+    
+    hits_at_1 = hits_at_k = reciprocal_ranks = 0
+    for item in questions:
+        texts = [doc['text'] for doc in tax_kb.search(item["question"], k=K)]
+        if item["expected"] in texts:
+            rank = texts.index(item["expected"]) + 1
+            hits_at_1 += rank == 1
+            hits_at_k += 1
+            reciprocal_ranks += 1 / rank
+    
+    latencies = []
+    for _ in range(ROUNDS):
+        for item in questions:
+            query_start = time.perf_counter()
+            tax_kb.search(item["question"], k=K)
+            latencies.append((time.perf_counter() - query_start) * 1000)
+    latencies.sort()
+    
+    n = len(questions)
+    return {
+        "build_s": build_s,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "hit_at_1": hits_at_1 / n,
+        f"recall_at_{K}": hits_at_k / n,
+        "mrr": reciprocal_ranks / n,
+    }
+
+def run_mode(mode: str):
+    env = dict(os.environ, RAG_MODE=mode)
+    env.setdefault("DATABASE_URL", "sqlite:///:memory:")
+    env.setdefault("SECRET_KEY", "benchmark")
+    # Fresh working directory so no cached faiss index from another mode is reused
+    with tempfile.TemporaryDirectory() as workdir:
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child"],
+            cwd=workdir, env=env, capture_output=True, text=True
+        )
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="+", default=["dense", "sparse", "hybrid"])
+    parser.add_argument("--child", action="store_true")
+    args = parser.parse_args()
+    
+    if args.child:
+        print(json.dumps(measure_mode()))
+        sys.exit(0)
+    
+    print(f" {'mode':<8} {'build s':>8} {'p50 ms':>8} {'p95 ms':>8} {'RSS MB':>8} {'hit@1':>6} {'R@' + str(K):>6} {'MRR':>6}")
+    for mode in args.modes:
+        result = run_mode(mode)
+        if "error" in result:
+            print(f" {mode:<8} error: {result['error']}")
+            continue
+        print(f" {mode:<8} {result['build_s']:8.2f} {result['p50_ms']:8.3f} {result['p95_ms']:8.3f} "
+              f"{result['peak_rss_mb']:8.1f} {result['hit_at_1']:6.2f} {result[f'recall_at_{K}']:6.2f} {result['mrr']:6.2f}")
@@ -0,0 +1,44 @@
+﻿"""
+Shared synthetic data for the benchmarks
+Importing this module puts backend/ on sys.path, so benchmark scripts can
+import app modules after it. Nothing from app/ is imported here at module
+level: run_benchmarks.py has to configure the environment first.
+"""
+import os
+import random
+import sys
+from typing import List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+NARRATIONS = ["SALARY CREDIT", "ATM WITHDRAWAL", "IBFT TRANSFER", "UTILITY BILL", "POS PURCHASE", "PROFIT PAID"]
+
+def statement_lines(rng: random.Random, rows: int = 40, page_no: int = None, with_pii: bool = False) -> List[str]:
+    title = "Meezan Bank Limited - Account Statement"
+    lines = [f"{title} - Page {page_no}" if page_no else title]
+    if with_pii:
+        # Account, CNIC, phone and email shapes that redact_pii must catch
+        lines += [
+            f"Account No: {rng.randint(10 ** 13, 10 ** 14 - 1)}  CNIC: 35202-{rng.randint(1000000, 9999999)}-1",
+            f"Contact: 03{rng.randint(100000000, 999999999)}  customer{rng.randint(1, 999)}@example.com",
+            "Employer: Systems Limited  Monthly Salary: Rs. 250,000.00",
+        ]
+    
+    balance = rng.randint(50000, 900000)
+    for day in range(rows):
+        amount = rng.randint(500, 250000)
+        balance += amount if rng.random() < 0.3 else -amount
+        lines.append(f"{day % 28 + 1:02d}-07-2025  {rng.choice(NARRATIONS):<16} Rs. {amount:,}.00  Rs. {balance:,}.00")
+    return lines
+
+def statement_text(rng: random.Random, rows: int = 40) -> str:
+    return "\n".join(statement_lines(rng, rows, with_pii=True))
+
+def statement_pages(rng: random.Random, pages: int, rows: int = 40) -> List[str]:
+    return ["\n".join(statement_lines(rng, rows, page_no=page_no + 1)) for page_no in range(pages)]
+
+def statement_pdf(rng: random.Random, pages: int) -> bytes:
+    from app.services.form_service import render_text_pdf
+    return render_text_pdf([statement_lines(rng, with_pii=True) for _ in range(pages)])
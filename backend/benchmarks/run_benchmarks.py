@@ -0,0 +1,334 @@
+﻿"""
+Offline benchmark suite for the hot paths
+Runs against a throwaway SQLite database and a stubbed Groq client, so it
+needs no network, Postgres or API key. Covers the tax engine, PII
+redaction, financial field parsing, PDF extraction on generated statements,
+TaxKnowledgeBase build/search and the main API endpoints driven through an
+in-process ASGI client under concurrency. Reports ops/sec and p50/p95/p99.
+
+Run from backend/:
+    python benchmarks/run_benchmarks.py                      # run, compare to baseline if present
+    python benchmarks/run_benchmarks.py --save-baseline      # store this run as the baseline
+    python benchmarks/run_benchmarks.py --quick --only api_  # shorter run, API benchmarks only
+Exits with status 1 when a benchmark loses more than --threshold of its
+baseline throughput or its p95 grows by more than --threshold (document
+upload, the noisiest, has a wider threshold of its own).
+baselines/baseline.json is a reference run (its meta block records the machine).
+Baselines are machine specific: re-record one with --save-baseline on each CI
+runner or workstation before gating on it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from fixtures import BACKEND_DIR, statement_text, statement_pdf
+
+QUESTIONS_FILE = os.path.join(BACKEND_DIR, "benchmarks", "data", "rag_questions.json")
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, "benchmarks", "baselines", "baseline.json")
+NOISE_FLOOR_MS = 0.05  # p95 changes below this are timer noise, not regressions
+# Per-benchmark --threshold overrides. Each upload also runs its chunk indexing
+# before the in-process client returns, and at the default concurrency the
+# CPU-bound requests mostly queue behind each other, so run-to-run spread is
+# far wider than for the other endpoints
+THRESHOLD_OVERRIDES = {"api_document_upload": 0.5}
+
+def configure_environment(work_dir: str, rag_mode: str):
+    # Must run before anything under app/ is imported: Settings reads the environment once
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(work_dir, 'bench.db')}",
+        "SECRET_KEY": "benchmark-secret",
+        "GROQ_API_KEY": "offline",
+        "RAG_MODE": rag_mode,
+        "UPLOAD_DIR": os.path.join(work_dir, "uploads"),
+        "FORMS_DIR": os.path.join(work_dir, "forms"),
+        "VECTOR_STORE_DIR": os.path.join(work_dir, "vector_store"),
+        "PROFILE_DIR": os.path.join(work_dir, "profiles"),
+        "PROFILING_ALLOW_HEADER": "false",
+        "PROFILING_SAMPLE_RATE": "0",
+    })
+    os.chdir(work_dir)
+
+class StubGroq:
+    # Stands in for groq.Groq: same call shape, canned answer, optional fixed latency
+    def __init__(self, latency_s: float):
+        self.latency_s = latency_s
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+    
+    def _create(self, **kwargs):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        message = SimpleNamespace(content="Income up to Rs. 600,000 is exempt for tax year 2025-26.")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+def summarize(latencies, elapsed: float):
+    import numpy as np
+    values = np.array(latencies) * 1000
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 4),
+        "p95_ms": round(float(np.percentile(values, 95)), 4),
+        "p99_ms": round(float(np.percentile(values, 99)), 4),
+    }
+
+def measure(fn, inputs, min_seconds: float, min_ops: int, warmup: int = 3):
+    # Warm-up calls fill caches and import lazily loaded code before timing
+    for position in range(warmup):
+        fn(inputs[position % len(inputs)])
+    latencies = []
+    started = time.perf_counter()
+    position = 0
+    while len(latencies) < min_ops or time.perf_counter() - started < min_seconds:
+        value = inputs[position % len(inputs)]
+        position += 1
+        start = time.perf_counter()
+        fn(value)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies, time.perf_counter() - started)
+
+def check_sweep_against_scalar(incomes, mixes):
+    # The vectorized sweep must agree with the scalar path /calculate uses;
+    # the slab lookups differ by at most a paisa at fractional slab edges
+    from app.services.tax_engine import sweep_scenarios, apply_capped_deductions, calculate_income_tax
+    sweep = sweep_scenarios(incomes, mixes)
+    for i, mix in enumerate(mixes):
+        for j in range(0, len(incomes), 37):
+            income = float(incomes[j])
+            allowed = apply_capped_deductions(income, *map(float, mix))
+            tax, _ = calculate_income_tax(max(0, income - allowed))
+            if abs(allowed - sweep["allowed_deductions"][i, j]) > 0.01 or abs(tax - sweep["tax"][i, j]) > 1:
+                raise SystemExit(f" sweep_scenarios disagrees with the scalar path at income {income}, mix {list(mix)}")
+
+def run_unit_benchmarks(args, selected):
+    import numpy as np
+    from app.services.tax_engine import calculate_income_tax, sweep_scenarios
+    from app.services.ocr_service import extract_financial_data, extract_pages_from_pdf
+    from app.core.security import redact_pii
+    from app.services.rag_service import TaxKnowledgeBase
+    
+    rng = random.Random(20250701)
+    results = {}
+    
+    if selected("calculate_income_tax"):
+        incomes = [rng.uniform(0, 20_000_000) for _ in range(1000)]
+        results["calculate_income_tax"] = measure(calculate_income_tax, incomes, args.seconds, 1000)
+    
+    if selected("sweep_scenarios"):
+        incomes = np.arange(0, 20_000_000, 4000, dtype=float)
+        mixes = np.array([[rng.randint(0, 400_000), rng.randint(0, 3_000_000), rng.randint(0, 2_000_000)] for _ in range(20)], dtype=float)
+        check_sweep_against_scalar(incomes, mixes)
+        results["sweep_scenarios"] = measure(lambda _: sweep_scenarios(incomes, mixes), [None], args.seconds, 20)
+    
+    texts = [statement_text(rng) for _ in range(50)]
+    if selected("redact_pii"):
+        results["redact_pii"] = measure(redact_pii, texts, args.seconds, 200)
+    if selected("extract_financial_data"):
+        results["extract_financial_data"] = measure(extract_financial_data, texts, args.seconds, 200)
+    
+    if selected("pdf_extract_pages"):
+        fixture_dir = tempfile.mkdtemp(dir=".")
+        paths = []
+        for index in range(5):
+            path = os.path.join(fixture_dir, f"statement_{index}.pdf")
+            with open(path, "wb") as f:
+                f.write(statement_pdf(rng, pages=10))
+            paths.append(path)
+        results["pdf_extract_pages"] = measure(extract_pages_from_pdf, paths, args.seconds, 10)
+    
+    with open(QUESTIONS_FILE, encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)]
+    
+    if selected("kb_build"):
+        def build(_):
+            # Fresh directory each time so nothing is loaded from a previous build
+            build_dir = tempfile.mkdtemp(dir=".")
+            cwd = os.getcwd()
+            os.chdir(build_dir)
+            try:
+                TaxKnowledgeBase(mode=args.rag_mode)
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(build_dir, ignore_errors=True)
+        results["kb_build"] = measure(build, [None], args.seconds, args.build_rounds, warmup=1)
+    
+    if selected("kb_search"):
+        from app.services.rag_service import tax_kb
+        results["kb_search"] = measure(lambda question: tax_kb.search(question, k=3), questions, args.seconds, 200)
+    
+    return results
+
+async def run_api_benchmarks(args, selected):
+    import httpx
+    from app.main import app
+    from app.db.session import init_db
+    from app.services import ai_service
+    
+    ai_service.client = StubGroq(args.groq_latency_ms / 1000)
+    init_db()
+    rng = random.Random(42)
+    results = {}
+    
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/api/auth/register", json={"email": "bench@example.com", "password": "bench", "full_name": "Bench"})
+        response = await client.post("/api/auth/login", data={"username": "bench@example.com", "password": "bench"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        
+        # Seed data the read endpoints work against
+        for index in range(5):
+            pdf = statement_pdf(rng, pages=2)
+            await client.post("/api/documents/upload", files={"file": (f"seed_{index}.pdf", pdf, "application/pdf")}, headers=headers)
+        for year in (2024, 2025):
+            await client.post("/api/wealth/", json={
+                "tax_year": year,
+                "bank_accounts": [{"bank_name": "Meezan", "account_number": f"{year}01", "balance": 1_500_000 * (year - 2023)}],
+                "properties": [{"description": "House", "value": 12_000_000}]
+            }, headers=headers)
+        
+        upload_pdf = statement_pdf(rng, pages=2)
+        scenarios = {
+            "api_calculate_tax": lambda i: client.post(
+                "/api/tax/calculate",
+                json={"salary_income": 600_000 + (i % 5000) * 1000, "deductions": 50_000},
+                headers=headers
+            ),
+            "api_tax_history": lambda i: client.get("/api/tax/history", headers=headers),
+            "api_chat": lambda i: client.post("/api/tax/chat", json={"question": "What is the tax on 2.5 million salary?"}, headers=headers),
+            "api_document_search": lambda i: client.get("/api/documents/search", params={"q": "salary credit"}, headers=headers),
+            "api_document_upload": lambda i: client.post(
+                "/api/documents/upload", files={"file": (f"bench_{i}.pdf", upload_pdf, "application/pdf")}, headers=headers
+            ),
+            "api_wealth_statement": lambda i: client.get("/api/wealth/2025", headers=headers),
+            "api_wealth_reconciliation": lambda i: client.get("/api/wealth/reconciliation", headers=headers),
+            "api_health": lambda i: client.get("/health"),
+        }
+        
+        for name, request in scenarios.items():
+            if not selected(name):
+                continue
+            total = args.api_requests
+            semaphore = asyncio.Semaphore(args.concurrency)
+            latencies = []
+            failures = 0
+            await request(-1)
+            
+            async def one(i):
+                nonlocal failures
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await request(i)
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code >= 400:
+                        failures += 1
+            
+            started = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(total)))
+            results[name] = summarize(latencies, time.perf_counter() - started)
+            results[name]["concurrency"] = args.concurrency
+            if failures:
+                results[name]["failures"] = failures
+    
+    return results
+
+def compare(current, baseline, threshold: float):
+    regressions = []
+    for name, result in current.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        allowed = max(threshold, THRESHOLD_OVERRIDES.get(name, 0))
+        throughput_change = (result["ops_per_sec"] - previous["ops_per_sec"]) / previous["ops_per_sec"]
+        p95_change = (result["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"] if previous["p95_ms"] else 0
+        p95_regressed = p95_change > allowed and result["p95_ms"] - previous["p95_ms"] > NOISE_FLOOR_MS
+        if throughput_change < -allowed or p95_regressed:
+            regressions.append(name)
+        flag = "REGRESSION" if name in regressions else ""
+        print(f" {name:<28} ops/s {throughput_change:+7.1%}  p95 {p95_change:+7.1%}  {flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=2.0, help="minimum wall time per unit benchmark")
+    parser.add_argument("--build-rounds", type=int, default=5)
+    parser.add_argument("--api-requests", type=int, default=400, help="requests per API benchmark")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--groq-latency-ms", type=float, default=0, help="simulated Groq round trip in the stub")
+    parser.add_argument("--rag-mode", default="sparse", choices=["sparse", "dense", "hybrid"],
+                        help="dense/hybrid need sentence-transformers and its model files available locally")
+    parser.add_argument("--only", nargs="*", default=[], help="run benchmarks whose name contains any of these")
+    parser.add_argument("--quick", action="store_true", help="short run for smoke checks")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--output", help="also write this run's JSON here")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown")
+    args = parser.parse_args()
+    if args.quick:
+        args.seconds, args.build_rounds, args.api_requests = 0.3, 2, 80
+    
+    baseline_path = os.path.abspath(args.baseline)
+    output_path = os.path.abspath(args.output) if args.output else None
+    selected = lambda name: not args.only or any(part in name for part in args.only)
+    
+    work_dir = tempfile.mkdtemp(prefix="taxgpt-bench-")
+    try:
+        configure_environment(work_dir, args.rag_mode)
+        from app.db import session
+        session.engine.echo = False
+        
+        results = run_unit_benchmarks(args, selected)
+        results.update(asyncio.run(run_api_benchmarks(args, selected)))
+    finally:
+        os.chdir(BACKEND_DIR)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print(f"\n {'benchmark':<28} {'ops/s':>11} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for name, result in results.items():
+        print(f" {name:<28} {result['ops_per_sec']:>11,.1f} {result['p50_ms']:>10.3f} {result['p95_ms']:>10.3f} {result['p99_ms']:>10.3f}")
+    
+    run = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rag_mode": args.rag_mode,
+            "concurrency": args.concurrency,
+            "quick": args.quick,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=2)
+    
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=2)
+        print(f"\n Saved baseline to {baseline_path}")
+        return 0
+    
+    if not os.path.exists(baseline_path):
+        print(f"\n No baseline at {baseline_path}; run with --save-baseline to create one")
+        return 0
+    
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    mismatched = [key for key in ("rag_mode", "concurrency", "quick") if baseline["meta"].get(key) != run["meta"][key]]
+    if mismatched:
+        print(f"\n Warning: baseline was recorded with different {', '.join(mismatched)}; comparison is not like for like")
+    print(f"\n Against baseline from {baseline['meta']['timestamp']} (threshold {args.threshold:.0%}):")
+    regressions = compare(results, baseline["results"], args.threshold)
+    if regressions:
+        print(f"\n {len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+﻿"""
+Schema Migration
+Upgrades databases created by an earlier version to the current models.
+create_all only creates missing tables; this adds the columns, indexes and
+unique keys that later changes put on tables that already existed. Existing
+rows get the column's default. Safe to re-run.
+Run from backend/: python migrate_db.py
+"""
+import sys
+sys.path.append('.')
+
+from sqlalchemy import inspect, literal, text
+from app.db.base import Base
+from app.db.session import engine, init_db
+
+# (table, column) added to existing tables
+NEW_COLUMNS = [
+    ("users", "is_admin"),
+    ("tax_calculations", "input_hash"),
+    ("tax_calculations", "employee_id"),
+    ("documents", "batch_id"),
+    ("tax_return_forms", "status"),
+    ("tax_return_forms", "content_hash"),
+]
+# (table, index name) declared on those columns
+NEW_INDEXES = [
+    ("documents", "ix_documents_batch_id"),
+    ("tax_calculations", "ix_tax_calculations_input_hash"),
+    ("tax_return_forms", "ix_tax_return_forms_content_hash"),
+]
+# (table, constraint name) of unique keys the application relies on
+NEW_UNIQUE_KEYS = [
+    # ON CONFLICT target of the background calculation writer
+    ("tax_calculations", "uq_tax_calculations_input"),
+]
+
+def column_ddl(column) -> str:
+    ddl = f"{column.name} {column.type.compile(dialect=engine.dialect)}"
+    for foreign_key in column.foreign_keys:
+        ddl += f" REFERENCES {foreign_key.column.table.name} ({foreign_key.column.name})"
+    if column.default is not None and column.default.is_scalar:
+        value = literal(column.default.arg, column.type).compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+        ddl += f" DEFAULT {value}"
+    return ddl
+
+def add_columns(connection) -> list:
+    inspector = inspect(connection)
+    added = []
+    for table_name, column_name in NEW_COLUMNS:
+        existing = {column["name"] for column in inspector.get_columns(table_name)}
+        if column_name in existing:
+            continue
+        column = Base.metadata.tables[table_name].c[column_name]
+        connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_ddl(column)}"))
+        added.append(f"{table_name}.{column_name}")
+    return added
+
+def add_indexes(connection) -> list:
+    inspector = inspect(connection)
+    added = []
+    for table_name, index_name in NEW_INDEXES:
+        if index_name in {index["name"] for index in inspector.get_indexes(table_name)}:
+            continue
+        table = Base.metadata.tables[table_name]
+        index = next(index for index in table.indexes if index.name == index_name)
+        index.create(bind=connection)
+        added.append(index_name)
+    return added
+
+def add_unique_keys(connection) -> list:
+    inspector = inspect(connection)
+    added = []
+    for table_name, constraint_name in NEW_UNIQUE_KEYS:
+        names = {item["name"] for item in inspector.get_unique_constraints(table_name)}
+        names.update(item["name"] for item in inspector.get_indexes(table_name))
+        if constraint_name in names:
+            continue
+        table = Base.metadata.tables[table_name]
+        constraint = next(item for item in table.constraints if item.name == constraint_name)
+        columns = ", ".join(column.name for column in constraint.columns)
+        if engine.dialect.name == "postgresql":
+            connection.execute(text(f"ALTER TABLE {table_name} ADD CONSTRAINT {constraint_name} UNIQUE ({columns})"))
+        else:
+            # SQLite cannot add constraints to an existing table; a unique index
+            # enforces the same key and serves ON CONFLICT just as well
+            connection.execute(text(f"CREATE UNIQUE INDEX {constraint_name} ON {table_name} ({columns})"))
+        added.append(constraint_name)
+    return added
+
+if __name__ == "__main__":
+    print(" Creating missing tables...")
+    init_db()
+    
+    with engine.begin() as connection:
+        for label, step in (("columns", add_columns), ("indexes", add_indexes), ("unique keys", add_unique_keys)):
+            added = step(connection)
+            print(f" Added {label}: {', '.join(added) if added else 'none'}")
+    
+    print(" Schema migration complete!")
@@ -0,0 +1,112 @@
+﻿"""
+Wealth Line Item Migration
+One-off upgrade for databases created before wealth statements were split
+into wealth_line_items: copies the old JSON asset/liability columns into line
+items, recomputes the totals and adds the (user_id, tax_year) unique key that
+create_all does not add to an existing table. Safe to re-run.
+Run from backend/: python migrate_wealth_line_items.py [--drop-legacy-columns]
+"""
+import argparse
+import json
+import sys
+sys.path.append('.')
+
+from sqlalchemy import inspect, text
+from app.db.session import SessionLocal, engine, init_db
+from app.services.wealth_service import LIST_CATEGORIES, SCALAR_CATEGORIES, line_items_from_input, upsert_line_items, refresh_totals
+from app.db.models import WealthStatement, WealthLineItem
+
+LEGACY_COLUMNS = list(LIST_CATEGORIES) + list(SCALAR_CATEGORIES)
+UNIQUE_NAME = "uq_wealth_statements_user_year"
+
+def legacy_columns():
+    existing = {column["name"] for column in inspect(engine).get_columns("wealth_statements")}
+    return [column for column in LEGACY_COLUMNS if column in existing]
+
+def remove_duplicate_statements(db) -> int:
+    # The old POST added a new statement on every submit, so a user can have
+    # several per year; keep the latest, matching how POST now replaces a year
+    rows = db.execute(text(
+        "SELECT id, user_id, tax_year FROM wealth_statements "
+        "ORDER BY user_id, tax_year, updated_at DESC, id DESC"
+    )).all()
+    seen, duplicates = set(), []
+    for statement_id, user_id, tax_year in rows:
+        if (user_id, tax_year) in seen:
+            duplicates.append(statement_id)
+        seen.add((user_id, tax_year))
+    
+    if duplicates:
+        db.query(WealthLineItem).filter(WealthLineItem.statement_id.in_(duplicates)).delete(synchronize_session=False)
+        db.query(WealthStatement).filter(WealthStatement.id.in_(duplicates)).delete(synchronize_session=False)
+    return len(duplicates)
+
+def backfill_line_items(db, columns) -> int:
+    migrated_ids = {row[0] for row in db.query(WealthLineItem.statement_id).distinct()}
+    rows = db.execute(text(f"SELECT id, {', '.join(columns)} FROM wealth_statements")).mappings().all()
+    
+    migrated = 0
+    for row in rows:
+        if row["id"] in migrated_ids:
+            continue
+        # SQLite hands JSON columns back as text, PostgreSQL as parsed values
+        wealth_data = {
+            column: json.loads(value) if isinstance(value, str) else value
+            for column, value in row.items() if column != "id"
+        }
+        items = line_items_from_input(wealth_data)
+        if not items:
+            continue
+        statement = db.get(WealthStatement, row["id"])
+        upsert_line_items(db, statement, items)
+        refresh_totals(db, statement)
+        migrated += 1
+    return migrated
+
+def add_unique_key(db) -> bool:
+    inspector = inspect(engine)
+    names = {item["name"] for item in inspector.get_unique_constraints("wealth_statements")}
+    names.update(item["name"] for item in inspector.get_indexes("wealth_statements"))
+    if UNIQUE_NAME in names:
+        return False
+    if engine.dialect.name == "postgresql":
+        db.execute(text(f"ALTER TABLE wealth_statements ADD CONSTRAINT {UNIQUE_NAME} UNIQUE (user_id, tax_year)"))
+    else:
+        # SQLite cannot add constraints to an existing table; a unique index
+        # enforces the same key and serves ON CONFLICT just as well
+        db.execute(text(f"CREATE UNIQUE INDEX {UNIQUE_NAME} ON wealth_statements (user_id, tax_year)"))
+    return True
+
+def drop_legacy_columns(db, columns):
+    for column in columns:
+        db.execute(text(f"ALTER TABLE wealth_statements DROP COLUMN {column}"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--drop-legacy-columns", action="store_true", help="drop the old JSON columns once copied")
+    args = parser.parse_args()
+    
+    print(" Creating missing tables...")
+    init_db()
+    columns = legacy_columns()
+    
+    db = SessionLocal()
+    try:
+        removed = remove_duplicate_statements(db)
+        print(f" Removed {removed} duplicate statement(s)")
+        if columns:
+            print(f" Migrated {backfill_line_items(db, columns)} statement(s) into wealth_line_items")
+        else:
+            print(" No legacy wealth columns found; nothing to copy")
+        print(f" Unique key {UNIQUE_NAME}: {'added' if add_unique_key(db) else 'already present'}")
+        if columns and args.drop_legacy_columns:
+            drop_legacy_columns(db, columns)
+            print(f" Dropped legacy columns: {', '.join(columns)}")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    
+    print(" Wealth migration complete!")